@@ -15,54 +15,58 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
 import cairo
+import shapely.geometry as spg
 import util
+from util import PAPER_SIZES, page_grid
+from instrumentation import stage, PAGES
 import math
 
-PAPER_SIZES = {
-    "4A0": (1682, 2378),
-    "2A0": (1189, 1682),
-    "A0": (841, 1189),
-    "A1": (594, 841),
-    "A2": (420, 594),
-    "A3": (297, 420),
-    "A4": (210, 297),
-    "A5": (148, 210),
-    "A6": (105, 148),
-    "A7": (74, 105),
-    "A8": (52, 74),
-    "A9": (37, 52),
-    "A10": (26, 37),
-    "Letter": (216, 279),
-    "Legal": (216, 356),
-    "Tabloid": (279, 432),
-    "Ledger": (432, 279),
-    "Junior Legal": (127, 203),
-    "Half Letter": (140, 216),
-    "Government Letter": (203, 267),
-    "Government Legal": (216, 330),
-    "ANSI A": (216, 279),
-    "ANSI B": (279, 432),
-    "ANSI C": (432, 559),
-    "ANSI D": (559, 864),
-    "ANSI E": (864, 1118),
-    "ARCH A": (229, 305),
-    "ARCH B": (305, 457),
-    "ARCH C": (457, 610),
-    "ARCH D": (610, 914),
-    "ARCH E": (914, 1219),
-    "ARCH E1": (762, 1067),
-    "ARCH E2": (660, 965),
-    "ARCH E3": (686, 991)
-}
+
+class CountingWriter:
+    def __init__(self, f):
+        self.f = f
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self.f.write(data)
+
+
+class ChunkWriter:
+    def __init__(self):
+        self.chunks = list()
+        self.bytes = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.bytes += len(data)
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
 
 class CairoTiler:
-    def __init__(self, pattern, size, paper_size = (210, 297), margins = (10,10,10,10), overlap=10, overview=True):
+    def __init__(self, pattern, size, paper_size = (210, 297), margins = (10,10,10,10), overlap=10, overview=True, outline=None, label_empty=False, draw=None):
         self.pattern = pattern
         self.size = size
         self.paper_size = paper_size
         self.overlap = overlap
         self.margins = margins
         self.overview = overview
+        # cut lines in document coordinates (mm). If given, pages without any
+        # cut line are skipped, or only labeled if label_empty is set. Edges
+        # facing a skipped page get no alignment marks.
+        self.outline = outline
+        self.label_empty = label_empty
+        self._skipped = None
+        # draw(ctx, window) draws the document region window = (x0, y0, x1, y1)
+        # in mm. If given, every page only gets the geometry clipped to it
+        # instead of a replay of the whole pattern.
+        self.draw = draw
+        self.stats = dict()
 
     def draw_alignment_mark(self, ctx, pos, rotation=0, flipx=False, flipy=False):
         ctx.save()
@@ -100,56 +104,158 @@ class CairoTiler:
         ctx.stroke()
         ctx.restore()
 
+    def page_is_empty(self, xoff, yoff):
+        if self.outline is None:
+            return False
+
+        page = spg.box(xoff, yoff,
+                       xoff + self.paper_size[0] - self.margins[0] - self.margins[2],
+                       yoff + self.paper_size[1] - self.margins[1] - self.margins[3])
+        return not page.intersects(self.outline)
+
+    def is_skipped(self, i, j):
+        # empty pages left out of the document, no alignment marks point at them
+        if self.outline is None or self.label_empty:
+            return False
+        if self._skipped is None:
+            self._skipped = {(page[0], page[1]) for page in self.pages() if page[4]}
+        return (i, j) in self._skipped
+
+    def draw_page_label(self, ctx, i, j, empty=False):
+        ctx.save()
+        ctx.scale(util.mm_to_pt(1), util.mm_to_pt(1))
+        ctx.set_source_rgba(0, 0, 0, 0.5)
+        ctx.set_font_size(3)
+        ctx.move_to(self.margins[2], self.margins[1] - 2)
+        ctx.show_text(f"column {i + 1}, row {j + 1}" + (" (empty)" if empty else ""))
+        ctx.restore()
+
     def tile(self, output):
-        surface = cairo.PDFSurface(output, util.mm_to_pt(self.paper_size[0]), util.mm_to_pt(self.paper_size[1]))
-        ctx = cairo.Context(surface)
+        if isinstance(output, str):
+            f = open(output, "wb")
+        else:
+            f = None
+        writer = CountingWriter(f if f is not None else output)
+
+        for _ in self._tile(writer):
+            pass
+
+        if f is not None:
+            f.close()
+        return self.stats
+
+    def stream(self):
+        # yields the document page by page as cairo writes it
+        writer = ChunkWriter()
+        for _ in self._tile(writer):
+            data = writer.drain()
+            if data:
+                yield data
 
-        n = math.ceil(self.size[0] / (self.paper_size[0]-self.overlap-self.margins[0]-self.margins[2]))
-        m = math.ceil(self.size[1] / (self.paper_size[1]-self.overlap-self.margins[1]-self.margins[3]))
+        data = writer.drain()
+        if data:
+            yield data
 
+    def page_grid(self):
+        return page_grid(self.size, self.paper_size, self.margins, self.overlap)
+
+    def pages(self):
+        # (column, row, x offset, y offset, empty) of every page
+        n, m = self.page_grid()
         for i in range(0, n):
             for j in range(0, m):
-                ctx.reset_clip()
-                ctx.identity_matrix()
                 xoff = i * ((self.paper_size[0] - self.margins[0] - self.margins[2])- self.overlap)
                 yoff = j * ((self.paper_size[1] - self.margins[1] - self.margins[3])- self.overlap)
+                yield (i, j, xoff, yoff, self.page_is_empty(xoff, yoff))
+
+    def render_page(self, ctx, page):
+        # draws page onto ctx in the current user space (pt)
+        ctx.save()
+        ctx.reset_clip()
+        if self.outline is not None:
+            self.draw_page_label(ctx, page[0], page[1], page[4])
+        if not page[4]:
+            self._render_page(ctx, page)
+        ctx.restore()
+
+    def _render_page(self, ctx, page):
+        i, j, xoff, yoff, _ = page
+        n, m = self.page_grid()
+
+        ctx.rectangle(util.mm_to_pt(self.margins[2]),
+                      util.mm_to_pt(self.margins[1]),
+                      util.mm_to_pt((self.paper_size[0] - self.margins[0] - self.margins[2])),
+                      util.mm_to_pt((self.paper_size[1] - self.margins[1] - self.margins[3])))
+        ctx.clip()
+        if self.draw is not None:
+            ctx.save()
+            ctx.set_line_join(cairo.LINE_JOIN_ROUND)
+            ctx.set_line_cap(cairo.LINE_CAP_ROUND)
+            ctx.scale(util.mm_to_pt(1), util.mm_to_pt(1))
+            ctx.translate(self.margins[2] - xoff, self.margins[1] - yoff)
+            self.draw(ctx, (xoff, yoff,
+                            xoff + self.paper_size[0] - self.margins[0] - self.margins[2],
+                            yoff + self.paper_size[1] - self.margins[1] - self.margins[3]))
+            ctx.restore()
+        else:
+            mat = cairo.Matrix()
+            mat.translate(util.mm_to_pt(xoff-self.margins[2]), util.mm_to_pt(yoff-self.margins[1]))
+            self.pattern.set_matrix(mat)
+            ctx.set_source(self.pattern)
+            ctx.paint()
+        ctx.reset_clip()
+
+        ul = (self.margins[2], self.margins[1])
+        ur = (self.paper_size[0] - self.margins[0], ul[1])
+        ll = (ul[0], self.paper_size[1] - self.margins[2])
+        lr = (ur[0], ll[1])
+
+        if j > 0 and not self.is_skipped(i, j - 1):
+            #Upper horizontal alignment marks
+            self.draw_alignment_mark(ctx, (self.margins[2], self.margins[1]))
+            self.draw_alignment_mark(ctx, (self.paper_size[0] - self.margins[0], self.margins[1]), flipx=True)
+
+        if j < (m-1) and not self.is_skipped(i, j + 1):
+            #Lower horizontal alignment marks
+            self.draw_alignment_mark(ctx, ll, flipy=True)
+            self.draw_alignment_mark(ctx, lr, flipx=True, flipy=True)
 
-                mat = cairo.Matrix()
-                mat.translate(util.mm_to_pt(xoff-self.margins[2]), util.mm_to_pt(yoff-self.margins[1]))
-                #ctx.translate(util.mm_to_pt(-xoff), util.mm_to_pt(-yoff))s
-                ctx.rectangle(util.mm_to_pt(self.margins[2]),
-                              util.mm_to_pt(self.margins[1]),
-                              util.mm_to_pt((self.paper_size[0] - self.margins[0] - self.margins[2])),
-                              util.mm_to_pt((self.paper_size[1] - self.margins[1] - self.margins[3])))
-                ctx.clip()
-                self.pattern.set_matrix(mat)
-                ctx.set_source(self.pattern)
-                ctx.paint()
-                ctx.reset_clip()
-
-                ul = (self.margins[2], self.margins[1])
-                ur = (self.paper_size[0] - self.margins[0], ul[1])
-                ll = (ul[0], self.paper_size[1] - self.margins[2])
-                lr = (ur[0], ll[1])
-
-                if j > 0:
-                    #Upper horizontal alignment marks
-                    self.draw_alignment_mark(ctx, (self.margins[2], self.margins[1]))
-                    self.draw_alignment_mark(ctx, (self.paper_size[0] - self.margins[0], self.margins[1]), flipx=True)
-
-                if j < (m-1):
-                    #Lower horizontal alignment marks
-                    self.draw_alignment_mark(ctx, ll, flipy=True)
-                    self.draw_alignment_mark(ctx, lr, flipx=True, flipy=True)
-
-                if i > 0:
-                    #Left vertical alignment marks
-                    self.draw_alignment_mark(ctx, ul, rotation=math.pi/2, flipx=True)
-                    self.draw_alignment_mark(ctx, ll, rotation=math.pi/2, flipy=True, flipx=True)
-
-                if i < (n-1):
-                    #Right vertical alignment marks
-                    self.draw_alignment_mark(ctx, ur, rotation=math.pi/2)
-                    self.draw_alignment_mark(ctx, lr, rotation=math.pi/2, flipy=True)
-                #ctx.translate(util.mm_to_pt(xoff), util.mm_to_pt(yoff))
+        if i > 0 and not self.is_skipped(i - 1, j):
+            #Left vertical alignment marks
+            self.draw_alignment_mark(ctx, ul, rotation=math.pi/2, flipx=True)
+            self.draw_alignment_mark(ctx, ll, rotation=math.pi/2, flipy=True, flipx=True)
+
+        if i < (n-1) and not self.is_skipped(i + 1, j):
+            #Right vertical alignment marks
+            self.draw_alignment_mark(ctx, ur, rotation=math.pi/2)
+            self.draw_alignment_mark(ctx, lr, rotation=math.pi/2, flipy=True)
+
+    def _tile(self, writer):
+        surface = cairo.PDFSurface(writer, util.mm_to_pt(self.paper_size[0]), util.mm_to_pt(self.paper_size[1]))
+        ctx = cairo.Context(surface)
+
+        n, m = self.page_grid()
+        skipped = 0
+
+        for page in self.pages():
+            if page[4]:
+                skipped += 1
+                if not self.label_empty:
+                    continue
+
+            with stage("page"):
+                self.render_page(ctx, page)
                 ctx.show_page()
+            PAGES.inc()
+            yield page[:2]
+
+        surface.finish()
+
+        pages = n * m - (0 if self.label_empty else skipped)
+        self.stats = {
+            "pages": pages,
+            "empty pages": skipped,
+            "bytes": writer.bytes,
+            # rough estimate, an average page also carries shared resources
+            "bytes saved": 0 if self.label_empty else round(skipped * writer.bytes / max(pages, 1))
+        }
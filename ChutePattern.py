@@ -14,68 +14,71 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
-import cairo
+import shapely
 import shapely.geometry as spg
-from shapely.geometry.base import JOIN_STYLE
+import shapely.affinity as spa
 import numpy as np
 import enum
-from util import mm_to_pt
+from util import mm_to_pt, LRUCache, GRID_TICKS
+from instrumentation import stage
 
-def draw_grid(ctx, offset, major_tick, minor_tick, height, width):
-    x_minorticks = np.arange(0, width, minor_tick)
-    x_majorticks = np.arange(0, width, major_tick)
-    y_minorticks = np.arange(0, height, minor_tick)
-    y_majorticks = np.arange(0, height, major_tick)
+# Stage caches, each keyed on everything the stage depends on: the sampled
+# outline on the geometry, the seam allowance polygon additionally on the seam
+# allowance and joint style, the recorded pattern additionally on the grid.
+_outline_cache = LRUCache(64)
+_seam_cache = LRUCache(64)
+_pattern_cache = LRUCache(16)
 
-    ctx.save()
-    ctx.push_group()
-    ctx.set_line_width(0.03)
-    ctx.set_source_rgb(0.9,0.9,0.9)
-    for x in x_minorticks:
-        x1 = x + offset[0]
-        y1 = 0 + offset[1]
-        x2 = x1
-        y2 = y1 + height
-        ctx.move_to(x1, y1)
-        ctx.line_to(x2, y2)
+_grid_cells = dict()
 
-    ctx.set_line_width(0.03)
-    ctx.set_source_rgb(0.9, 0.9, 0.9)
-    for y in y_minorticks:
-        x1 = 0 + offset[0]
-        y1 = y + offset[1]
-        x2 = x1 + width
-        y2 = y1
+# cairo is only imported by the functions that draw, so that outlines, seam
+# allowance and metrics work without it
 
-        ctx.move_to(x1, y1)
-        ctx.line_to(x2, y2)
+def grid_cell(major_tick, minor_tick):
+    import cairo
 
-    ctx.stroke()
+    key = (major_tick, minor_tick)
+    if key in _grid_cells:
+        return _grid_cells[key]
 
-    ctx.set_line_width(0.1)
-    ctx.set_source_rgb(0.9,0.9,0.9)
-    for x in x_majorticks:
-        x1 = x + offset[0]
-        y1 = 0 + offset[1]
-        x2 = x1
-        y2 = y1 + height
-        ctx.move_to(x1, y1)
-        ctx.line_to(x2, y2)
+    # One major_tick x major_tick cell, repeated across the document. Lines on
+    # the cell border are drawn on both sides so that the halves of neighbouring
+    # cells add up to the full line width.
+    surface = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, cairo.Rectangle(0, 0, major_tick, major_tick))
+    ctx = cairo.Context(surface)
+    ctx.set_source_rgb(0.9, 0.9, 0.9)
+
+    ctx.set_line_width(0.03)
+    for t in np.arange(0, major_tick + minor_tick/2, minor_tick):
+        ctx.move_to(t, 0)
+        ctx.line_to(t, major_tick)
+        ctx.move_to(0, t)
+        ctx.line_to(major_tick, t)
+    ctx.stroke()
 
     ctx.set_line_width(0.1)
-    ctx.set_source_rgb(0.9, 0.9, 0.9)
-    for y in y_majorticks:
-        x1 = 0 + offset[0]
-        y1 = y + offset[1]
-        x2 = x1 + width
-        y2 = y1
-        ctx.move_to(x1, y1)
-        ctx.line_to(x2, y2)
-  
+    for t in (0, major_tick):
+        ctx.move_to(t, 0)
+        ctx.line_to(t, major_tick)
+        ctx.move_to(0, t)
+        ctx.line_to(major_tick, t)
     ctx.stroke()
-    ctx.pop_group_to_source()
-    ctx.paint()
-    
+
+    pattern = cairo.SurfacePattern(surface)
+    pattern.set_extend(cairo.EXTEND_REPEAT)
+    _grid_cells[key] = pattern
+    return pattern
+
+def draw_grid(ctx, offset, major_tick, minor_tick, height, width):
+    import cairo
+
+    pattern = grid_cell(major_tick, minor_tick)
+    pattern.set_matrix(cairo.Matrix(x0=-offset[0], y0=-offset[1]))
+
+    ctx.save()
+    ctx.rectangle(offset[0], offset[1], width, height)
+    ctx.set_source(pattern)
+    ctx.fill()
     ctx.restore()
 
 class MitreType(enum.Enum):
@@ -86,10 +89,20 @@ class MitreType(enum.Enum):
 
 
 class ChutePattern:
-    def __init__(self, grid, seam_allowance=(10,10,10,10)):
+    margins = (10, 10, 10, 10)
+
+    def __init__(self, grid, seam_allowance=(10,10,10,10), tolerance=0.1):
         self.grid = grid
         self.seam_allowance=seam_allowance
         self.joint_style = MitreType.none
+        self.tolerance = tolerance
+        self.sampling = {"samples": 0, "max deviation": 0.0}
+
+    @classmethod
+    def from_spec(cls, spec, grid=True, seam_allowance=(10,10,10,10), tolerance=0.1):
+        # shares the spec, and the values derived from it, with the caller
+        return cls(spec.diameter, spec.num_panels, spec.e, spec.tangent_lines, spec.line_length,
+                   spec.spill_hole_diameter, grid, seam_allowance, tolerance, spec=spec)
 
     def set_joint_style(self, joint_style):
         self.joint_style = joint_style
@@ -97,41 +110,151 @@ class ChutePattern:
     def set_grid(self, grid):
         self.grid = grid
 
+    def set_tolerance(self, tolerance):
+        self.tolerance = tolerance
+
     def description(self):
         pass
 
+    def get_line_lengths(self):
+        return dict()
+
     def _get_pattern_path(self):
         return (np.array([]), np.array([]))
 
-    def add_seamallowance(self, polygon, line, seam_allowance):
-        if line.length < 0.01:
-            return polygon
-
-        offset_line = line.parallel_offset(seam_allowance, "right")
-        coord = list(line.coords)
-        coord1 = list(offset_line.coords)
-        coord1.reverse()
-        coord.extend(coord1)
-        seam = spg.Polygon(coord)
-        return polygon.union(seam)
-
-    def add_seamallowance_bevel(self, lines, seam_allowance):
-        coords = list()
-
-        for i,l in enumerate(lines):
-            if l.length <= 0.001:
-                print(l)
-                continue
-            if seam_allowance[i] > 0:
-                ol = l.parallel_offset(seam_allowance[i], "right")
-                coord = list(ol.coords[::-1])
-            else:
-                coord = list(l.coords)
-            coords.extend(coord)
-
-        return spg.Polygon(coords)
-
-    def print_info(self, ctx):
+    def _edge(self, ts, tmin):
+        return (np.zeros_like(ts), np.zeros_like(ts))
+
+    def _sample_edge(self, tmin, tmax, initial=8, max_samples=10000):
+        # Bisect segments until the chordal deviation of every segment midpoint
+        # is below the tolerance (mm). Points end up where the edge is curved.
+        if self.tolerance is None:
+            ts = np.linspace(tmin, tmax, 100)
+            u, l = self._edge(ts, tmin)
+            self.sampling = {"samples": len(ts), "max deviation": None}
+            return (u, l)
+
+        ts = np.linspace(tmin, tmax, initial + 1)
+        u, l = self._edge(ts, tmin)
+
+        while True:
+            tm = (ts[:-1] + ts[1:]) / 2
+            um, lm = self._edge(tm, tmin)
+
+            du = np.diff(u)
+            dl = np.diff(l)
+            chord = np.hypot(du, dl)
+            cross = np.abs(du * (lm - l[:-1]) - dl * (um - u[:-1]))
+            deviation = np.divide(cross, chord, out=np.hypot(um - u[:-1], lm - l[:-1]), where=chord > 0)
+
+            refine = np.nonzero(deviation > self.tolerance)[0]
+            if len(refine) == 0 or len(ts) + len(refine) > max_samples:
+                break
+
+            ts = np.insert(ts, refine + 1, tm[refine])
+            u = np.insert(u, refine + 1, um[refine])
+            l = np.insert(l, refine + 1, lm[refine])
+
+        self.sampling = {"samples": len(ts), "max deviation": float(np.max(deviation))}
+        return (u, l)
+
+    def _gore_edges(self, u, l):
+        right = np.column_stack((u, l))
+        left = np.column_stack((-u[::-1], l[::-1]))
+
+        return {"right": right,
+                "top": np.array([right[-1], left[0]]),
+                "left": left,
+                "bottom": np.array([left[-1], right[0]])}
+
+    def _offset_edge(self, coords, width):
+        # Offsets a polyline by width to its right. Interior vertices move
+        # along their miter normal, which keeps every offset segment at exactly
+        # width from its original. Returns the offset points and the unit
+        # directions of the first and last segment.
+        d = np.diff(coords, axis=0)
+        length = np.hypot(d[:, 0], d[:, 1])
+        keep = np.concatenate(([True], length > 1e-9))
+        coords, d, length = coords[keep], d[keep[1:]], length[keep[1:]]
+        d = d / length[:, None]
+
+        normals = np.column_stack((d[:, 1], -d[:, 0]))
+        vertex_normals = np.empty_like(coords)
+        vertex_normals[0] = normals[0]
+        vertex_normals[-1] = normals[-1]
+        # limited to a miter of twice the width at sharp vertices
+        cos = np.maximum(1 + np.sum(normals[:-1] * normals[1:], axis=1), 0.5)
+        vertex_normals[1:-1] = (normals[:-1] + normals[1:]) / cos[:, None]
+
+        return (coords + width * vertex_normals, d[0], d[-1])
+
+    def _join(self, corner, a, b, da, db, wa, wb, mitre_limit=2):
+        # points between the end a of one offset edge and the start b of the
+        # next one, around the corner both edges share
+        turn = da[0] * db[1] - da[1] * db[0]
+        if self.joint_style == MitreType.none or turn <= 1e-9:
+            # inner corners and joint style none go through the corner itself,
+            # overlapping parts are removed afterwards
+            return [corner]
+
+        if self.joint_style == MitreType.bevel:
+            return []
+
+        if self.joint_style == MitreType.miter:
+            # intersection of both offset lines
+            s = ((b[0] - a[0]) * db[1] - (b[1] - a[1]) * db[0]) / turn
+            mitre = a + s * da
+            w = max(wa, wb)
+            if np.hypot(*(mitre - corner)) <= mitre_limit * w:
+                return [mitre]
+
+            # clip the mitre at mitre_limit * width from the corner
+            m = (mitre - corner) / np.hypot(*(mitre - corner))
+            c = mitre_limit * w
+            sa = (c - np.dot(a - corner, m)) / np.dot(da, m)
+            sb = (c - np.dot(b - corner, m)) / np.dot(db, m)
+            return [a + sa * da, b + sb * db]
+
+        # round, radius changes linearly from wa to wb
+        start = np.arctan2(-da[0], da[1])
+        sweep = np.arctan2(turn, np.dot(da, db))
+        w = max(wa, wb)
+        tolerance = self.tolerance if self.tolerance else 0.1
+        step = 2 * np.arccos(max(1 - tolerance / w, -1)) if w > tolerance else np.pi / 2
+        n = int(np.ceil(sweep / step))
+        f = np.arange(1, n) / n
+        r = wa + f * (wb - wa)
+        angle = start + f * sweep
+        return list(corner + np.column_stack((r * np.cos(angle), r * np.sin(angle))))
+
+    def offset_polygon(self, lines, widths):
+        # Adds the seam allowance to the gore in a single pass: every edge is
+        # offset by its own width, consecutive offset edges are connected with
+        # the joint style and the resulting ring is only repaired if it
+        # intersects itself.
+        edges = list()
+        for line, width in zip(lines, widths):
+            coords = np.asarray(line.coords)
+            if line.length > 0.001:
+                edges.append((coords, width) + self._offset_edge(coords, width))
+
+        ring = list()
+        for k, (coords, width, offset, _, d_end) in enumerate(edges):
+            ring.extend(offset)
+            n_coords, n_width, n_offset, n_start, _ = edges[(k + 1) % len(edges)]
+            ring.extend(self._join(coords[-1], offset[-1], n_offset[0], d_end, n_start, width, n_width))
+
+        polygon = spg.Polygon(ring)
+        if not polygon.is_valid:
+            faces = shapely.polygonize(shapely.get_parts(shapely.union_all(spg.LineString(ring + ring[:1]))))
+            polygon = shapely.union_all(shapely.get_parts(faces))
+            if polygon.geom_type == "MultiPolygon":
+                polygon = max(polygon.geoms, key=lambda p: p.area)
+            polygon = spg.Polygon(polygon.exterior)
+
+        return polygon
+
+    def print_info(self, ctx, window=None):
         font_size = 3
         ctx.set_font_size(3)
         ctx.set_source_rgba(0, 0, 0, 0.5)
@@ -139,103 +262,227 @@ class ChutePattern:
         for k, v in self.description().items():
             lines.append(f"{k}: {v}")
 
+        if window is not None:
+            width = max(ctx.text_extents(l).x_advance for l in lines)
+            text = spg.box(10, 10, 10 + width, 10 + font_size * (len(lines) + 1))
+            if not text.intersects(spg.box(*window)):
+                return
+
         y_pos = 10
         for l in lines:
             y_pos += font_size
             ctx.move_to(10, y_pos)
             ctx.show_text(l)
 
+    def _geometry_key(self):
+        return (type(self).__name__, )
+
+    def outline_key(self):
+        return (self._geometry_key(), self.tolerance)
+
+    def seam_key(self):
+        return (self.outline_key(), tuple(self.seam_allowance), self.joint_style.name)
+
+    def pattern_key(self):
+        return (self.seam_key(), bool(self.grid))
+
+    def get_outline(self):
+        key = self.outline_key()
+        outline = _outline_cache.get(key)
+
+        if outline is None:
+            with stage("outline"):
+                pattern_lines = self._get_pattern_path()
+                lines = {k: spg.LineString(pattern_lines[k]) for k in ("right", "top", "left", "bottom")}
+
+                coords = list()
+                for line in lines.values():
+                    coords.extend(line.coords)
+
+                outline = (lines, spg.Polygon(coords), self.sampling)
+            _outline_cache.put(key, outline)
+
+        lines, polygon, self.sampling = outline
+        return (lines, polygon)
+
+    def get_seam_polygon(self):
+        key = self.seam_key()
+        polygon = _seam_cache.get(key)
+        if polygon is not None:
+            return polygon
+
+        lines, polygon = self.get_outline()
+        line_right = lines["right"]
+        line_top = lines["top"]
+        line_left = lines["left"]
+        line_bottom = lines["bottom"]
+
+        if any(w > 0 for w in self.seam_allowance):
+            with stage("seam"):
+                polygon = self.offset_polygon([line_right, line_top, line_left, line_bottom], self.seam_allowance)
+
+        _seam_cache.put(key, polygon)
+        return polygon
+
+    def summary(self):
+        lines, outline = self.get_outline()
+        polygon = self.get_seam_polygon()
+        minx, miny, maxx, maxy = polygon.bounds
+        seam_length = lines["right"].length + lines["left"].length
+
+        return {
+            "description": self.description(),
+            "panels": self.num_panels,
+            "area": outline.area,
+            "cut_area": polygon.area,
+            "total_area": outline.area * self.num_panels,
+            "total_cut_area": polygon.area * self.num_panels,
+            "seam_length": seam_length,
+            "total_seam_length": seam_length * self.num_panels / 2,
+            "hem_length": lines["top"].length + lines["bottom"].length,
+            "bounding_box": {"width": maxx - minx, "height": maxy - miny},
+            "line_lengths": self.get_line_lengths(),
+            "sampling": self.sampling
+        }
+
+    def metrics(self):
+        _, outline = self.get_outline()
+        polygon = self.get_seam_polygon()
+
+        metrics = self.summary()
+        metrics["outline"] = [list(c) for c in outline.exterior.coords]
+        metrics["cut_outline"] = [list(c) for c in polygon.exterior.coords]
+        return metrics
+
+    def get_preview(self, resolution=512):
+        # Seam allowance and stitch line in document coordinates (mm) as
+        # float32 arrays, simplified to about resolution points across the
+        # larger side of the document. Nothing is drawn, cairo is not needed.
+        width, height = self.get_document_size()
+        tolerance = max(width, height) / resolution
+        cut, outline = self.get_cut_lines().geoms
+
+        return {
+            "size": (width, height),
+            "cut": np.asarray(cut.simplify(tolerance, preserve_topology=False).coords, dtype=np.float32),
+            "outline": np.asarray(outline.simplify(tolerance, preserve_topology=False).coords, dtype=np.float32)
+        }
+
+    def get_cut_lines(self):
+        # seam allowance and stitch line in document coordinates (mm), placed
+        # like _record_pattern does: y axis flipped, pattern centered in margins
+        _, outline = self.get_outline()
+        polygon = self.get_seam_polygon()
+        minx, _, _, maxy = polygon.bounds
+        margins = self.margins
+
+        lines = spg.MultiLineString([polygon.exterior.coords, outline.exterior.coords])
+        return spa.affine_transform(lines, [1, 0, 0, -1,
+                                            -minx + (margins[0] + margins[1])/2,
+                                            maxy + (margins[2] + margins[3])/2])
+
     def get_pattern(self):
-        pattern_lines = self._get_pattern_path()
-        line_right = spg.LineString(pattern_lines["right"])
-        line_top = spg.LineString(pattern_lines["top"])
-        line_left = spg.LineString(pattern_lines["left"])
-        line_bottom = spg.LineString(pattern_lines["bottom"])
-
-        coords = list()
-        coords.extend(line_right.coords)
-        coords.extend(line_top.coords)
-        coords.extend(line_left.coords)
-        coords.extend(line_bottom.coords)
- 
-        polygon = spg.Polygon(coords)
-        ui, li = polygon.exterior.xy
-
-        ui = np.array(ui)
-        li = np.array(li)
-
-        if self.joint_style == MitreType.none:
-            if self.seam_allowance[0] > 0:
-                polygon = self.add_seamallowance(polygon, line_right, self.seam_allowance[0])
-            if self.seam_allowance[1] > 0:
-                polygon = self.add_seamallowance(polygon, line_top, self.seam_allowance[1])
-            if self.seam_allowance[2] > 0:
-                polygon = self.add_seamallowance(polygon, line_left, self.seam_allowance[2])
-            if self.seam_allowance[3] > 0:
-                polygon = self.add_seamallowance(polygon, line_bottom, self.seam_allowance[3])
-        elif len(set(self.seam_allowance)) == 1:
-            if self.joint_style == MitreType.miter:
-                jt = JOIN_STYLE.mitre
-            elif self.joint_style == MitreType.bevel:
-                jt = JOIN_STYLE.bevel
-            elif self.joint_style == MitreType.round:
-                jt = JOIN_STYLE.round
-            polygon = polygon.buffer(self.seam_allowance[0], join_style=jt, mitre_limit=2)
-        elif self.joint_style == MitreType.bevel:
-            polygon = self.add_seamallowance_bevel([line_right, line_top, line_left, line_bottom], self.seam_allowance)
-        elif self.joint_style == MitreType.round:
-            print("ERROR: joint style \"round\" not supported for non uniform seam allowance. Please use bevel or none")
-        elif self.joint_style == MitreType.miter:
-            print("ERROR: joint style \"miter\" not supported for non uniform seam allowance. Please use bevel or none")
-
-        u,l = polygon.exterior.xy
-
-        u = np.array(u)
-        l = np.array(l)
-
-        margins = (10, 10, 10, 10)
-        l = l * -1
-        li = li * -1
-
-        pattern_extend = (np.min(u), np.min(l), np.max(u), np.max(l))
-        pattern_width = pattern_extend[2] - pattern_extend[0]
-        pattern_height = pattern_extend[3] - pattern_extend[1]
-
-        document_width = pattern_width + margins[0] + margins[1]
-        document_height = pattern_height + margins[2] + margins[3]
+        import cairo
+
+        key = self.pattern_key()
+        recorded = _pattern_cache.get(key)
+
+        if recorded is None:
+            with stage("record"):
+                recorded = self._record_pattern()
+            _pattern_cache.put(key, recorded)
+
+        # the pattern is shared between callers, CairoTiler moves it around
+        pattern, size = recorded
+        pattern.set_matrix(cairo.Matrix())
+        return (pattern, size)
+
+    def get_document_size(self):
+        minx, miny, maxx, maxy = self.get_seam_polygon().bounds
+        margins = self.margins
+
+        return (maxx - minx + margins[0] + margins[1],
+                maxy - miny + margins[2] + margins[3])
+
+    def _stroke_lines(self, ctx, geometry, closed):
+        if geometry.is_empty:
+            return
+        if hasattr(geometry, "geoms"):
+            for g in geometry.geoms:
+                self._stroke_lines(ctx, g, closed)
+            return
+        if geometry.geom_type != "LineString":
+            return
+
+        coords = geometry.coords
+        ctx.move_to(*coords[0])
+        for x, y in coords[1:]:
+            ctx.line_to(x, y)
+        if closed:
+            ctx.close_path()
 
-        surface = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, cairo.Rectangle(0, 0, mm_to_pt(document_width), mm_to_pt(document_height)))
-        ctx = cairo.Context(surface)
-        ctx.save()
-        ctx.set_line_join(cairo.LINE_JOIN_ROUND)
-        ctx.set_line_cap(cairo.LINE_CAP_ROUND)
-        ctx.push_group()
-        ctx.scale(mm_to_pt(1), mm_to_pt(1))
-        ctx.save()
+    def draw(self, ctx, window=None):
+        # Draw the pattern in document coordinates (mm). If window (x0, y0, x1, y1)
+        # is given only the geometry inside of it is drawn, which keeps tiled
+        # pages from carrying the whole pattern.
+        document_width, document_height = self.get_document_size()
+        seam, stitch = self.get_cut_lines().geoms
+
+        if window is not None:
+            clip = spg.box(*window)
+            seam = seam.intersection(clip)
+            stitch = stitch.intersection(clip)
 
+        ctx.save()
         if self.grid:
-            draw_grid(ctx, (0,0), 10, 1, document_height, document_width)
+            draw_grid(ctx, (0,0), *GRID_TICKS, document_height, document_width)
 
         #draw seam allowance
-        ctx.translate(-pattern_extend[0] + (document_width/2 - pattern_width/2),
-                      -pattern_extend[1] + (document_height/2 - pattern_height/2))
-        ctx.move_to(u[0], l[0])
-        for x,y in zip(u, l):
-            ctx.line_to(x, y)
-        ctx.close_path()
+        self._stroke_lines(ctx, seam, window is None)
         ctx.set_source_rgb(.0, .0, .0)
         ctx.set_line_width(0.3)
         ctx.stroke()
 
         #draw pattern
-        ctx.move_to(ui[0], li[0])
-        for x,y in zip(ui, li):
-            ctx.line_to(x, y)
-        ctx.close_path()
+        self._stroke_lines(ctx, stitch, window is None)
         ctx.set_source_rgb(1, .0, .0)
         ctx.set_line_width(0.3)
         ctx.stroke()
         ctx.restore()
-        self.print_info(ctx)
+
+        self.print_info(ctx, window)
+
+    def draw_thumbnail(self, ctx, line_width):
+        # Only the seam allowance and the stitch line, no grid and no text, in
+        # document coordinates (mm) with line_width in the same units. Strokes
+        # of a replayed recording would shrink below a pixel at this size.
+        import cairo
+
+        seam, stitch = self.get_cut_lines().geoms
+
+        ctx.save()
+        ctx.set_line_width(line_width)
+        ctx.set_line_join(cairo.LINE_JOIN_ROUND)
+        self._stroke_lines(ctx, seam, True)
+        ctx.set_source_rgb(.0, .0, .0)
+        ctx.stroke()
+        self._stroke_lines(ctx, stitch, True)
+        ctx.set_source_rgb(1, .0, .0)
+        ctx.stroke()
+        ctx.restore()
+
+    def _record_pattern(self):
+        import cairo
+
+        document_width, document_height = self.get_document_size()
+
+        surface = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, cairo.Rectangle(0, 0, mm_to_pt(document_width), mm_to_pt(document_height)))
+        ctx = cairo.Context(surface)
+        ctx.save()
+        ctx.set_line_join(cairo.LINE_JOIN_ROUND)
+        ctx.set_line_cap(cairo.LINE_CAP_ROUND)
+        ctx.push_group()
+        ctx.scale(mm_to_pt(1), mm_to_pt(1))
+        self.draw(ctx)
         pattern = ctx.pop_group()
         return (pattern, (document_width, document_height))
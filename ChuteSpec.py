@@ -0,0 +1,122 @@
+""" ChuteMaker
+Copyright (C) 2022 Thomas Schmid
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+import hashlib
+import json
+import math
+
+
+# Immutable description of a canopy's geometry. The inputs are normalized and
+# validated once on construction. Derived quantities are computed on first use
+# and kept, and equal specs hash equal, so a spec can be used directly as a
+# cache key. digest() is stable across processes and versions of Python.
+class ChuteSpec:
+    __slots__ = ("diameter", "num_panels", "e", "tangent_lines", "line_length",
+                 "spill_hole_diameter", "_derived", "_hash")
+    kind = None
+
+    def __init__(self, diameter, num_panels, e, tangent_lines=True, line_length=None, spill_hole_diameter=None):
+        diameter = float(diameter)
+        num_panels = int(num_panels)
+        e = float(e)
+        tangent_lines = bool(tangent_lines)
+        # the line length only matters with tangent lines
+        line_length = float(line_length) if tangent_lines and line_length else 2 * diameter
+        spill_hole_diameter = float(spill_hole_diameter) if spill_hole_diameter else 0.0
+
+        if diameter <= 0:
+            raise ValueError("diameter must be positive")
+        if num_panels < 1:
+            raise ValueError("at least one panel is needed")
+        if e <= 0:
+            raise ValueError("e must be positive")
+        if line_length <= 0:
+            raise ValueError("line length must be positive")
+        if spill_hole_diameter < 0:
+            raise ValueError("spill hole diameter must not be negative")
+
+        for name, value in (("diameter", diameter), ("num_panels", num_panels), ("e", e),
+                            ("tangent_lines", tangent_lines), ("line_length", line_length),
+                            ("spill_hole_diameter", spill_hole_diameter), ("_derived", dict())):
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, "_hash", hash(self.key()))
+
+        self.validate()
+
+    def validate(self):
+        pass
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return (type(self), (self.diameter, self.num_panels, self.e, self.tangent_lines,
+                             self.line_length, self.spill_hole_diameter))
+
+    def key(self):
+        return (self.kind, self.diameter, self.num_panels, self.e, self.tangent_lines,
+                self.line_length, self.spill_hole_diameter)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.key() == other.key()
+
+    def __repr__(self):
+        return (f"{type(self).__name__}(diameter={self.diameter!r}, num_panels={self.num_panels!r}, "
+                f"e={self.e!r}, tangent_lines={self.tangent_lines!r}, line_length={self.line_length!r}, "
+                f"spill_hole_diameter={self.spill_hole_diameter!r})")
+
+    def to_dict(self):
+        return {
+            "type": self.kind,
+            "diameter": self.diameter,
+            "panels": self.num_panels,
+            "e": self.e,
+            "tangent_lines": self.tangent_lines,
+            "line_length": self.line_length,
+            "spill_diameter": self.spill_hole_diameter
+        }
+
+    def _derive(self, name, compute):
+        if name not in self._derived:
+            self._derived[name] = compute()
+        return self._derived[name]
+
+    def digest(self):
+        return self._derive("digest", lambda: hashlib.sha256(json.dumps(self.key()).encode("utf-8")).hexdigest())
+
+    @property
+    def tangent_t(self):
+        # parameter where the tangent lines touch the canopy
+        return 0.0
+
+    @property
+    def tmin(self):
+        return self._derive("tmin", lambda: -self.tangent_t if self.tangent_lines else 0.0)
+
+    @property
+    def tmax(self):
+        # parameter of the edge of the canopy at the spill hole
+        return math.pi/2
+
+    @property
+    def line_lengths(self):
+        return dict()
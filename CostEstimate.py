@@ -0,0 +1,97 @@
+""" ChuteMaker
+Copyright (C) 2022 Thomas Schmid
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Predicts the size and cost of a document from the parameters alone, cheap
+# enough to check every request against budgets before any geometry is
+# sampled or anything is drawn. The document size comes from the closed form
+# gore dimensions of sweep.py, the pages from the same page grid CairoTiler
+# uses. draw_grid fills every page with one repeated cell, so the grid costs
+# the same per page whatever the page shows. Bytes and seconds are linear in
+# these counts, with rough per unit costs meant to be checked against the
+# results of benchmark.py.
+
+import math
+
+import sweep
+from ChutePattern import ChutePattern
+from util import page_grid
+
+# bytes of a document, of every page, of every path segment and of the grid
+# on one page, per file type
+BYTES = {
+    "pdf": {"document": 2000, "page": 1500, "segment": 8, "grid": 800},
+    "svg": {"document": 1000, "page": 0, "segment": 20, "grid": 1500}
+}
+
+# seconds for a document, every page, every path segment and the grid on one
+# page
+SECONDS = {"document": 0.02, "page": 0.004, "segment": 2e-6, "grid": 0.001}
+
+
+def gore_size(spec):
+    # width and length (mm) of the finished gore
+    if spec.kind == "toroidal":
+        gore = sweep.toroidal_sweep(spec.diameter, spec.num_panels, spec.e, spec.line_length,
+                                    spec.spill_hole_diameter, spec.tangent_lines)
+    else:
+        gore = sweep.spherical_sweep(spec.diameter, spec.num_panels, spec.e, spec.line_length,
+                                     spec.spill_hole_diameter, spec.tangent_lines)
+    return (float(gore["gore_width"]), float(gore["gore_length"]))
+
+
+def path_segments(spec, gore_length, tolerance=0.1):
+    # Segments of the stitch line and the seam allowance. The sampling bisects
+    # until the chord of every segment deviates less than tolerance, for a
+    # curvature radius of about the canopy radius that gives chords of
+    # sqrt(8 * radius * tolerance). Measured counts are within a factor of two.
+    if tolerance is None:
+        samples = 100
+    else:
+        samples = min(10000, max(9, math.ceil(gore_length / math.sqrt(8 * spec.diameter / 2 * tolerance))))
+    return 2 * (2 * samples + 2)
+
+
+def estimate(spec, seam_allowance=(10, 10, 10, 10), joint_style="none", grid=False, file_type="pdf",
+             paper_size=None, margin=10, overlap=10, tolerance=0.1):
+    gore_width, gore_length = gore_size(spec)
+    # mitred corners can reach past the seam allowance
+    reach = 2 if joint_style == "miter" else 1
+    margins = ChutePattern.margins
+    size = (gore_width + reach * (seam_allowance[0] + seam_allowance[2]) + margins[0] + margins[1],
+            gore_length + reach * (seam_allowance[1] + seam_allowance[3]) + margins[2] + margins[3])
+
+    if paper_size is not None:
+        columns, rows = page_grid(size, paper_size, (margin, margin, margin, margin), overlap)
+    else:
+        columns, rows = (1, 1)
+    pages = columns * rows
+    segments = path_segments(spec, gore_length, tolerance)
+
+    costs = BYTES[file_type]
+    # tiled pages only draw the path clipped to them, together about one copy
+    document_bytes = (costs["document"] + pages * costs["page"] + segments * costs["segment"]
+                      + (pages * costs["grid"] if grid else 0))
+    seconds = (SECONDS["document"] + pages * SECONDS["page"] + segments * SECONDS["segment"]
+               + (pages * SECONDS["grid"] if grid else 0))
+
+    return {
+        "document_size": size,
+        "page_grid": (columns, rows),
+        "pages": pages,
+        "segments": segments,
+        "bytes": round(document_bytes),
+        "seconds": seconds
+    }
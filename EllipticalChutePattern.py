@@ -14,29 +14,101 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
-from scipy import integrate
 from ChutePattern import ChutePattern
+from ChuteSpec import ChuteSpec
 import numpy as np
 import math
 
-class EllipticChutePattern(ChutePattern):
-    def __init__(self, diameter, num_panels, e, tangent_lines=True, line_length = None, spill_hole_diameter = None, grid=True, seam_allowance=(10,10,10,10)):
-        self.diameter = diameter
-        self.radius = diameter/2
-        self.num_panels = num_panels
-        self._a = self.radius
-        self._b = self.radius * e
-        self._e = e
-        self.spill_hole = spill_hole_diameter
-
-        self.tangent_lines = tangent_lines
-
-        if self.tangent_lines and not line_length:
-            self.line_length = 2*self.diameter
-        else:
-            self.line_length = line_length
+# The functions below take scalars or NumPy arrays, so the pattern class and
+# the parameter sweeps in sweep.py share them.
+
+def tangential_line_point(a, e, line_length):
+    l2 = line_length**2
+    r2 = a**2
+    e2 = e**2
+
+    x = np.sqrt(2)/2 * np.sqrt((-l2-r2+np.sqrt(4*e2*l2*r2+l2**2-2*l2*r2+r2**2))/(e2-1))
+    return np.arccos(x/a)
+
+def arc_length(a, b, t0, t1):
+    # sqrt(a^2 sin^2 t + b^2 cos^2 t) = b * sqrt(1 - m sin^2 t) with m = 1 - a^2/b^2,
+    # so the arc length is the incomplete elliptic integral of the second kind
+    # scipy.special takes longer to import than everything else, toroidal
+    # chutes don't need it
+    from scipy import special
+
+    m = 1 - a**2 / b**2
+
+    return b * (special.ellipeinc(t1, m) - special.ellipeinc(t0, m))
+
+def gore_area(a, b, num_panels, t0, t1):
+    # Integral of the gore width 2*pi*a*cos(t)/n over the arc length. With
+    # s = sin(t) the integrand becomes sqrt(b^2 + c2*s^2) with c2 = a^2 - b^2.
+    c2 = a**2 - b**2
+    c = np.sqrt(np.abs(c2))
+
+    def primitive(s):
+        root = np.sqrt(b**2 + c2 * s**2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            oblate = np.arcsinh(c * s / b) * b**2 / (2 * c)
+            prolate = np.arcsin(np.clip(c * s / b, -1, 1)) * b**2 / (2 * c)
+        return np.where(c2 > 0, s * root / 2 + oblate,
+                        np.where(c2 < 0, s * root / 2 + prolate, b * s))
+
+    return 2 * np.pi * a / num_panels * (primitive(np.sin(t1)) - primitive(np.sin(t0)))
+
+class SphericalSpec(ChuteSpec):
+    __slots__ = ()
+    kind = "spherical"
+
+    def validate(self):
+        if self.spill_hole_diameter >= self.diameter:
+            raise ValueError("spill hole diameter must be smaller than the diameter")
+        if self.tangent_lines and self.e == 1:
+            # tangential_line_point divides by e**2 - 1
+            raise ValueError("tangent lines need an e other than 1, the canopy is a hemisphere")
+
+    @property
+    def a(self):
+        return self.diameter / 2
+
+    @property
+    def b(self):
+        return self.diameter / 2 * self.e
+
+    @property
+    def tangent_t(self):
+        return self._derive("tangent_t", lambda: float(tangential_line_point(self.a, self.e, self.line_length)))
+
+    @property
+    def tmax(self):
+        if not self.spill_hole_diameter:
+            return math.pi/2
+        return self._derive("tmax", lambda: math.acos(self.spill_hole_diameter/(2*self.a)))
+
+    @property
+    def line_lengths(self):
+        if not self.tangent_lines:
+            return dict()
+        return {"A": self.line_length}
 
-        super().__init__(grid, seam_allowance)
+class EllipticChutePattern(ChutePattern):
+    def __init__(self, diameter, num_panels, e, tangent_lines=True, line_length = None, spill_hole_diameter = None, grid=True, seam_allowance=(10,10,10,10), tolerance=0.1, spec=None):
+        if spec is None:
+            spec = SphericalSpec(diameter, num_panels, e, tangent_lines, line_length, spill_hole_diameter)
+        self.spec = spec
+
+        self.diameter = spec.diameter
+        self.radius = spec.a
+        self.num_panels = spec.num_panels
+        self._a = spec.a
+        self._b = spec.b
+        self._e = spec.e
+        self.spill_hole = spec.spill_hole_diameter
+        self.tangent_lines = spec.tangent_lines
+        self.line_length = spec.line_length
+
+        super().__init__(grid, seam_allowance, tolerance)
 
     def description(self):
         return {
@@ -48,57 +120,31 @@ class EllipticChutePattern(ChutePattern):
             "seam allowance": self.seam_allowance
         }
 
+    def get_line_lengths(self):
+        return self.spec.line_lengths
+
     def _elliptic_x(self, t):
-        return self.radius * math.cos(t)
+        return self._a * np.cos(t)
 
     def _elliptic_y(self, t):
-        return self.radius * self.e * math.sin(t)
+        return self._b * np.sin(t)
 
     def _tangential_line_point(self):
-        l2 = self.line_length**2
-        r2 = self.radius**2
-        e2 = self._e**2
+        return self.spec.tangent_t
 
-        x = math.sqrt(2)/2 * math.sqrt((-l2-r2+math.sqrt(4*e2*l2*r2+l2**2-2*l2*r2+r2**2))/(e2-1))
-        t = math.acos(x/self._a)
+    def _elliptic_integral(self, ts, t0):
+        return arc_length(self._a, self._b, t0, ts)
 
-        return t
+    def _edge(self, ts, tmin):
+        u = math.pi * self._elliptic_x(ts) / self.num_panels
+        l = self._elliptic_integral(ts, tmin)
 
-    def _elliptic_integral(self, ts):
-        func = lambda a,b,t: math.sqrt(a**2 * math.sin(t)**2 + b**2 * math.cos(t)**2)
+        return (u, l)
 
-        return integrate.cumulative_trapezoid(y = [func(self._a, self._b, t) for t in ts], x= ts, initial=0)
+    def _geometry_key(self):
+        return self.spec
 
     def _get_pattern_path(self):
-        tmin = 0
-
-        if self.tangent_lines:
-            tmin = -self._tangential_line_point()
-
-        if self.spill_hole:
-            tmax = math.acos(self.spill_hole/(2*self._a))
-        else:
-            tmax = math.pi/2
-
-        n = 100
-        ts = np.linspace(tmin, tmax, n)
-        x = [self._elliptic_x(t) for t in ts]
-        u = np.array([math.pi*xe for xe in x]) / self.num_panels
-        l = self._elliptic_integral(ts)
-
-        right_x = u
-        right_y = l
-
-        left_x = [-e for e in u[::-1]]
-        left_y = [e for e in l[::-1]]
-
-        top_x = [right_x[-1], left_x[0]]
-        top_y = [right_y[-1], left_y[0]]
-
-        bottom_x = [left_x[-1], right_x[0]]
-        bottom_y = [left_y[-1], right_y[0]]
+        u, l = self._sample_edge(self.spec.tmin, self.spec.tmax)
 
-        return {"right": zip(right_x, right_y),
-                "top": zip(top_x, top_y),
-                "left" : zip(left_x, left_y),
-                "bottom": zip(bottom_x, bottom_y)}
\ No newline at end of file
+        return self._gore_edges(u, l)
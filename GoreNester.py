@@ -0,0 +1,172 @@
+""" ChuteMaker
+Copyright (C) 2022 Thomas Schmid
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+import shapely
+import shapely.affinity as spa
+from util import mm_to_pt
+from instrumentation import stage
+
+
+# Lays out num_panels copies of the cut gore on a roll of fixed width. The roll
+# runs along x, its width along y. Copies alternate between two rotations 180
+# degrees apart and are placed lane by lane, each one slid against its
+# predecessor until the cut lines are `spacing` apart. Both gore orientations
+# (length along and across the roll) are tried and the shorter marker is kept.
+class GoreNester:
+    def __init__(self, chute, roll_width, spacing=5, margin=10, tolerance=0.1):
+        self.chute = chute
+        self.roll_width = roll_width
+        self.spacing = spacing
+        self.margin = margin
+        self.tolerance = tolerance
+
+        self.placements = list()
+        self.length = 0
+
+    def _oriented(self, polygon, angle):
+        piece = spa.rotate(polygon, angle, origin=(0, 0))
+        minx, miny, _, _ = piece.bounds
+        return (spa.translate(piece, -minx, -miny), (-minx, -miny))
+
+    def _slide(self, piece, lane, y, x_lo, x_hi):
+        # smallest x in [x_lo, x_hi] at which piece does not touch the lane
+        tree = shapely.STRtree(lane)
+
+        def free(x):
+            candidate = spa.translate(piece, x, y)
+            return len(tree.query(candidate, predicate="intersects")) == 0
+
+        if free(x_lo):
+            return x_lo
+
+        while x_hi - x_lo > self.tolerance:
+            x = (x_lo + x_hi) / 2
+            if free(x):
+                x_hi = x
+            else:
+                x_lo = x
+        return x_hi
+
+    def _nest(self, polygon, base_angle):
+        pieces = [self._oriented(polygon, base_angle + a) for a in (0, 180)]
+        grown = [p.buffer(self.spacing / 2) for p, _ in pieces]
+
+        _, _, width, height = pieces[0][0].bounds
+        lanes = int((self.roll_width + self.spacing) // (height + self.spacing))
+        if lanes == 0:
+            return None
+
+        count = self.chute.num_panels
+        placed = [list() for _ in range(lanes)]
+        frontier = [0.0] * lanes
+        placements = list()
+
+        for i in range(count):
+            lane = min(range(lanes), key=lambda k: frontier[k])
+            y = lane * (height + self.spacing)
+            k = len(placed[lane]) % 2
+            piece, (dx, dy) = pieces[k]
+
+            if placed[lane]:
+                x_lo = placed[lane][-1].bounds[0] + self.spacing / 2
+                x = self._slide(grown[k], placed[lane], y, x_lo, frontier[lane] + self.spacing + self.tolerance)
+            else:
+                x = 0.0
+
+            placed[lane].append(spa.translate(grown[k], x, y))
+            frontier[lane] = max(frontier[lane], x + width)
+            placements.append((base_angle + 180 * k, x + dx, y + dy))
+
+        return (placements, max(frontier))
+
+    def nest(self):
+        polygon = self.chute.get_seam_polygon()
+
+        best = None
+        for base_angle in (90, 0):
+            with stage("nest"):
+                result = self._nest(polygon, base_angle)
+            if result is not None and (best is None or result[1] < best[1]):
+                best = result
+
+        if best is None:
+            raise ValueError("gore does not fit on the roll")
+
+        self.placements, self.length = best
+        return self.placements
+
+    def utilization(self):
+        if not self.placements:
+            self.nest()
+        area = self.chute.get_seam_polygon().area * len(self.placements)
+        return area / (self.roll_width * self.length)
+
+    def place(self, geometry, placement):
+        angle, x, y = placement
+        return spa.translate(spa.rotate(geometry, angle, origin=(0, 0)), x, y)
+
+    def get_marker(self):
+        if not self.placements:
+            self.nest()
+
+        _, outline = self.chute.get_outline()
+        polygon = self.chute.get_seam_polygon()
+
+        import cairo
+
+        document_width = self.length + 2 * self.margin
+        document_height = self.roll_width + 2 * self.margin
+
+        surface = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, cairo.Rectangle(0, 0, mm_to_pt(document_width), mm_to_pt(document_height)))
+        ctx = cairo.Context(surface)
+        ctx.set_line_join(cairo.LINE_JOIN_ROUND)
+        ctx.set_line_cap(cairo.LINE_CAP_ROUND)
+        ctx.push_group()
+        ctx.scale(mm_to_pt(1), mm_to_pt(1))
+        ctx.translate(self.margin, self.margin)
+
+        #roll edges
+        ctx.move_to(0, 0)
+        ctx.line_to(document_width - self.margin, 0)
+        ctx.move_to(0, self.roll_width)
+        ctx.line_to(document_width - self.margin, self.roll_width)
+        ctx.set_source_rgb(0.6, 0.6, 0.6)
+        ctx.set_line_width(0.5)
+        ctx.stroke()
+
+        for i, placement in enumerate(self.placements):
+            for geometry, color in ((polygon, (0, 0, 0)), (outline, (1, 0, 0))):
+                coords = self.place(geometry, placement).exterior.coords
+                ctx.move_to(*coords[0])
+                for x, y in coords[1:]:
+                    ctx.line_to(x, y)
+                ctx.close_path()
+                ctx.set_source_rgb(*color)
+                ctx.set_line_width(0.3)
+                ctx.stroke()
+
+            center = self.place(outline, placement).centroid
+            ctx.set_font_size(10)
+            ctx.set_source_rgba(0, 0, 0, 0.5)
+            ctx.move_to(center.x, center.y)
+            ctx.show_text(str(i + 1))
+
+        ctx.set_font_size(3)
+        ctx.move_to(0, self.roll_width + 5)
+        ctx.show_text(f"roll width: {self.roll_width:.0f}, marker length: {self.length:.0f}, utilization: {100 * self.utilization():.1f} %")
+
+        pattern = ctx.pop_group()
+        return (pattern, (document_width, document_height))
@@ -0,0 +1,186 @@
+""" ChuteMaker
+Copyright (C) 2022 Thomas Schmid
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    name TEXT,
+    mime TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    error TEXT
+)
+"""
+
+
+def _run_job(render, params, path):
+    try:
+        render(params, path)
+    except Exception as e:
+        with open(path + ".error", "w") as f:
+            f.write(f"{type(e).__name__}: {e}")
+        raise SystemExit(1)
+
+
+# Render jobs in background processes. The job table lives in SQLite next to
+# the artifacts, so every web worker process can enqueue, poll and download,
+# and at most max_running jobs run at the same time across all of them. Each
+# process starts its dispatcher threads on first use, so nothing runs in a
+# pre-fork master.
+class JobQueue:
+    def __init__(self, directory, render, max_running=2, timeout=300, retention=3600, poll_interval=0.5):
+        self.directory = directory
+        self.render = render
+        self.max_running = max_running
+        self.timeout = timeout
+        self.retention = retention
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._threads = list()
+        self._last_cleanup = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        with closing(self._connect()) as db:
+            db.execute(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(os.path.join(self.directory, "jobs.sqlite"), timeout=30, isolation_level=None)
+
+    def artifact(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def _start(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.max_running:
+                t = threading.Thread(target=self._dispatch, daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, params, name=None, mime=None):
+        job_id = uuid.uuid4().hex
+        with closing(self._connect()) as db:
+            db.execute("INSERT INTO jobs (id, status, params, name, mime, created) VALUES (?, 'queued', ?, ?, ?, ?)",
+                       (job_id, json.dumps(params), name, mime, time.time()))
+        self._start()
+        return job_id
+
+    def get(self, job_id):
+        self._start()
+        with closing(self._connect()) as db:
+            db.row_factory = sqlite3.Row
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id, )).fetchone()
+
+        if row is None:
+            return None
+
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        if job["status"] == "queued":
+            with closing(self._connect()) as db:
+                job["position"] = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created < ?",
+                                             (job["created"], )).fetchone()[0]
+        return job
+
+    def _claim(self):
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            running = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+            row = None
+            if running < self.max_running:
+                row = db.execute("SELECT id, params FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1").fetchone()
+            if row is not None:
+                db.execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ?", (time.time(), row[0]))
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+        return row
+
+    def _finish(self, job_id, status, error=None):
+        with closing(self._connect()) as db:
+            db.execute("UPDATE jobs SET status = ?, finished = ?, error = ? WHERE id = ?",
+                       (status, time.time(), error, job_id))
+
+    def _run(self, job_id, params):
+        path = self.artifact(job_id)
+        tmp = path + ".part"
+
+        ctx = multiprocessing.get_context("spawn")
+        process = ctx.Process(target=_run_job, args=(self.render, params, tmp), daemon=True)
+        process.start()
+        process.join(self.timeout)
+
+        if process.is_alive():
+            process.terminate()
+            process.join()
+            self._finish(job_id, "failed", f"timeout after {self.timeout} s")
+        elif process.exitcode != 0:
+            error = f"exit code {process.exitcode}"
+            if os.path.exists(tmp + ".error"):
+                with open(tmp + ".error") as f:
+                    error = f.read()
+            self._finish(job_id, "failed", error)
+        else:
+            os.replace(tmp, path)
+            self._finish(job_id, "done")
+
+        for p in (tmp, tmp + ".error"):
+            if os.path.exists(p):
+                os.remove(p)
+
+    def _dispatch(self):
+        while True:
+            if time.time() - self._last_cleanup > 60:
+                self._last_cleanup = time.time()
+                self.cleanup()
+
+            job = self._claim()
+            if job is None:
+                time.sleep(self.poll_interval)
+                continue
+
+            try:
+                self._run(job[0], json.loads(job[1]))
+            except Exception as e:
+                self._finish(job[0], "failed", f"{type(e).__name__}: {e}")
+
+    def cleanup(self):
+        now = time.time()
+        with closing(self._connect()) as db:
+            # running jobs of a web worker that died are never finished
+            db.execute("UPDATE jobs SET status = 'failed', finished = ?, error = 'lost' WHERE status = 'running' AND started < ?",
+                       (now, now - 2 * self.timeout))
+            expired = db.execute("SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+                                 (now - self.retention, )).fetchall()
+            for (job_id, ) in expired:
+                if os.path.exists(self.artifact(job_id)):
+                    os.remove(self.artifact(job_id))
+                db.execute("DELETE FROM jobs WHERE id = ?", (job_id, ))
@@ -0,0 +1,121 @@
+""" ChuteMaker
+Copyright (C) 2022 Thomas Schmid
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Vector output for cutting plotters and laser cutters, written directly from
+# the pattern geometry without cairo. Every piece has two layers: CUT, the
+# outline with seam allowance, and MARK, the stitch line. All MARK geometry
+# comes before all CUT geometry, so that the cutter marks every piece before
+# it is cut loose, and the pen changes once. Coordinates are in mm with the y
+# axis pointing up and the origin at the lower left corner.
+
+import shapely.affinity as spa
+
+
+LAYERS = {
+    # name: (DXF color, HPGL pen)
+    "CUT": (7, 1),
+    "MARK": (1, 2)
+}
+
+# HPGL plotter units per mm
+HPGL_UNITS = 40
+
+
+def chute_layers(chute):
+    _, outline = chute.get_outline()
+    polygon = chute.get_seam_polygon()
+    minx, miny, _, _ = polygon.bounds
+
+    return [("MARK", spa.translate(outline, -minx, -miny)),
+            ("CUT", spa.translate(polygon, -minx, -miny))]
+
+
+def nested_layers(nester):
+    # all panels as placed by a GoreNester
+    if not nester.placements:
+        nester.nest()
+
+    _, outline = nester.chute.get_outline()
+    polygon = nester.chute.get_seam_polygon()
+    return [(layer, nester.place(geometry, placement))
+            for layer, geometry in (("MARK", outline), ("CUT", polygon))
+            for placement in nester.placements]
+
+
+def rings(geometry):
+    if hasattr(geometry, "geoms"):
+        for g in geometry.geoms:
+            yield from rings(g)
+    elif geometry.geom_type == "Polygon":
+        yield (geometry.exterior.coords, True)
+        for interior in geometry.interiors:
+            yield (interior.coords, True)
+    elif not geometry.is_empty:
+        yield (geometry.coords, geometry.is_closed)
+
+
+def _num(x):
+    s = f"{x:.3f}".rstrip("0").rstrip(".")
+    return "0" if s == "-0" else s
+
+
+def dxf_lines(layers):
+    # AutoCAD R12 DXF, the version every cutter software reads
+    yield "0\nSECTION\n2\nHEADER\n9\n$ACADVER\n1\nAC1009\n0\nENDSEC\n"
+    yield f"0\nSECTION\n2\nTABLES\n0\nTABLE\n2\nLAYER\n70\n{len(LAYERS)}\n"
+    for name, (color, _) in LAYERS.items():
+        yield f"0\nLAYER\n2\n{name}\n70\n0\n62\n{color}\n6\nCONTINUOUS\n"
+    yield "0\nENDTAB\n0\nENDSEC\n"
+
+    yield "0\nSECTION\n2\nENTITIES\n"
+    for layer, geometry in layers:
+        for coords, closed in rings(geometry):
+            if closed:
+                coords = coords[:-1]
+            yield f"0\nPOLYLINE\n8\n{layer}\n66\n1\n70\n{1 if closed else 0}\n"
+            yield "".join(f"0\nVERTEX\n8\n{layer}\n10\n{_num(x)}\n20\n{_num(y)}\n" for x, y in coords)
+            yield f"0\nSEQEND\n8\n{layer}\n"
+    yield "0\nENDSEC\n0\nEOF\n"
+
+
+def hpgl_lines(layers):
+    yield "IN;\n"
+    pen = None
+    for layer, geometry in layers:
+        if LAYERS[layer][1] != pen:
+            pen = LAYERS[layer][1]
+            yield f"SP{pen};\n"
+        for coords, _ in rings(geometry):
+            points = [(round(x * HPGL_UNITS), round(y * HPGL_UNITS)) for x, y in coords]
+            yield f"PU{points[0][0]},{points[0][1]};PD" + ",".join(f"{x},{y}" for x, y in points[1:]) + ";\n"
+    yield "PU;SP0;\n"
+
+
+WRITERS = {
+    "dxf": dxf_lines,
+    "hpgl": hpgl_lines
+}
+
+
+def write_plotter(layers, output, typ="dxf"):
+    if typ not in WRITERS:
+        raise ValueError(f"unknown plotter type {typ}")
+
+    written = 0
+    with open(output, "w", newline="\n") as f:
+        for chunk in WRITERS[typ](layers):
+            written += f.write(chunk)
+    return written
@@ -0,0 +1,221 @@
+""" ChuteMaker
+Copyright (C) 2022 Thomas Schmid
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+import io
+import math
+import struct
+import sys
+import zlib
+
+import cairo
+import numpy as np
+
+import util
+
+
+class PNGEncoder:
+    def __init__(self, f, width, height, dpi):
+        self.f = f
+        self.compressor = zlib.compressobj(6)
+
+        f.write(b"\x89PNG\r\n\x1a\n")
+        # 8 bit RGB
+        self.chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        ppm = round(dpi / 0.0254)
+        self.chunk(b"pHYs", struct.pack(">IIB", ppm, ppm, 1))
+
+    def chunk(self, tag, data):
+        self.f.write(struct.pack(">I", len(data)))
+        self.f.write(tag)
+        self.f.write(data)
+        self.f.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag))))
+
+    def write_rows(self, rows):
+        # every scanline starts with filter type 0
+        rows = np.concatenate((np.zeros((rows.shape[0], 1), dtype=np.uint8),
+                               rows.reshape(rows.shape[0], -1)), axis=1)
+        data = self.compressor.compress(rows.tobytes())
+        if data:
+            self.chunk(b"IDAT", data)
+
+    def finish(self):
+        self.chunk(b"IDAT", self.compressor.flush())
+        self.chunk(b"IEND", b"")
+
+
+# Baseline little endian TIFF with one deflate compressed strip per rendered
+# strip. The directory is written after the image data, the header offset is
+# patched at the end, so the output has to be seekable.
+class TIFFEncoder:
+    def __init__(self, f, width, height, dpi):
+        self.f = f
+        self.width = width
+        self.height = height
+        self.dpi = dpi
+        self.rows_per_strip = None
+        self.offsets = list()
+        self.counts = list()
+
+        self.start = f.tell()
+        f.write(b"II*\x00\x00\x00\x00\x00")
+        self.position = 8
+
+    def write(self, data):
+        self.f.write(data)
+        self.position += len(data)
+
+    def write_rows(self, rows):
+        if self.rows_per_strip is None:
+            self.rows_per_strip = rows.shape[0]
+        data = zlib.compress(rows.tobytes(), 6)
+        self.offsets.append(self.position)
+        self.counts.append(len(data))
+        self.write(data)
+
+    def finish(self):
+        if self.position % 2:
+            self.write(b"\x00")
+
+        tags = [
+            (256, 4, [self.width]),
+            (257, 4, [self.height]),
+            (258, 3, [8, 8, 8]),
+            (259, 3, [8]),
+            (262, 3, [2]),
+            (273, 4, self.offsets),
+            (277, 3, [3]),
+            (278, 4, [self.rows_per_strip or self.height]),
+            (279, 4, self.counts),
+            (282, 5, [(round(self.dpi * 100), 100)]),
+            (283, 5, [(round(self.dpi * 100), 100)]),
+            (296, 3, [2]),
+        ]
+
+        ifd = self.position
+        extra = ifd + 2 + 12 * len(tags) + 4
+        entries = b""
+        values = b""
+        for tag, typ, value in tags:
+            if typ == 3:
+                data = struct.pack(f"<{len(value)}H", *value)
+            elif typ == 4:
+                data = struct.pack(f"<{len(value)}I", *value)
+            else:
+                data = b"".join(struct.pack("<II", *v) for v in value)
+
+            if len(data) <= 4:
+                entries += struct.pack("<HHI", tag, typ, len(value)) + data.ljust(4, b"\x00")
+            else:
+                entries += struct.pack("<HHII", tag, typ, len(value), extra + len(values))
+                values += data
+
+        self.write(struct.pack("<H", len(tags)) + entries + b"\x00\x00\x00\x00" + values)
+
+        self.f.seek(self.start + 4)
+        self.f.write(struct.pack("<I", ifd))
+        self.f.seek(0, 2)
+
+
+ENCODERS = {
+    "png": PNGEncoder,
+    "tiff": TIFFEncoder
+}
+
+
+# Renders a document into a raster image strip by strip. Only one strip of
+# strip_height rows is held in memory at a time and handed to the encoder, so
+# memory use does not grow with the image size. Like CairoTiler either the
+# recorded pattern is replayed for every strip, or, if given, draw(ctx,
+# window) draws only the part of the document inside window (mm).
+class RasterExporter:
+    def __init__(self, pattern, size, dpi=150, strip_height=256, draw=None):
+        self.pattern = pattern
+        self.size = size
+        self.dpi = dpi
+        self.strip_height = strip_height
+        self.draw = draw
+
+        self.width = math.ceil(util.mm_to_pt(size[0]) * dpi / 72)
+        self.height = math.ceil(util.mm_to_pt(size[1]) * dpi / 72)
+
+    def strips(self):
+        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, self.width, self.strip_height)
+        ctx = cairo.Context(surface)
+        ctx.set_line_join(cairo.LINE_JOIN_ROUND)
+        ctx.set_line_cap(cairo.LINE_CAP_ROUND)
+        stride = surface.get_stride()
+        scale = self.dpi / 25.4
+
+        for y in range(0, self.height, self.strip_height):
+            rows = min(self.strip_height, self.height - y)
+
+            ctx.identity_matrix()
+            ctx.set_source_rgb(1, 1, 1)
+            ctx.paint()
+
+            ctx.scale(scale, scale)
+            ctx.translate(0, -y / scale)
+            if self.draw is not None:
+                self.draw(ctx, (0, y / scale, self.size[0], (y + rows) / scale))
+            else:
+                ctx.scale(1 / util.mm_to_pt(1), 1 / util.mm_to_pt(1))
+                self.pattern.set_matrix(cairo.Matrix())
+                ctx.set_source(self.pattern)
+                ctx.paint()
+            surface.flush()
+
+            # cairo stores RGB24 as native endian 32 bit words
+            data = np.frombuffer(surface.get_data(), dtype=np.uint8).reshape(self.strip_height, stride)
+            pixels = data[:rows, :4 * self.width].reshape(rows, self.width, 4)
+            if sys.byteorder == "little":
+                yield pixels[:, :, 2::-1]
+            else:
+                yield pixels[:, :, 1:]
+
+    def export(self, output, typ="png"):
+        if typ not in ENCODERS:
+            raise ValueError(f"unknown raster type {typ}")
+
+        f = open(output, "wb") if isinstance(output, str) else output
+        encoder = ENCODERS[typ](f, self.width, self.height, self.dpi)
+        for rows in self.strips():
+            encoder.write_rows(np.ascontiguousarray(rows))
+        encoder.finish()
+
+        if f is not output:
+            f.close()
+        return (self.width, self.height)
+
+
+def thumbnail(chute, width, height=None):
+    # PNG of at most width x height pixels with the outline of the chute
+    # centered in it
+    height = height or width
+    document_width, document_height = chute.get_document_size()
+    scale = min(width / document_width, height / document_height)
+
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, max(1, round(scale * document_width)),
+                                 max(1, round(scale * document_height)))
+    ctx = cairo.Context(surface)
+    ctx.set_source_rgb(1, 1, 1)
+    ctx.paint()
+    ctx.scale(scale, scale)
+    chute.draw_thumbnail(ctx, 1 / scale)
+    surface.flush()
+
+    f = io.BytesIO()
+    surface.write_to_png(f)
+    return f.getvalue()
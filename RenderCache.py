@@ -0,0 +1,171 @@
+""" ChuteMaker
+Copyright (C) 2022 Thomas Schmid
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from util import LRUCache
+
+# Bump whenever the rendered output changes for the same parameters, so stale
+# cache entries and client ETags are not reused.
+#  2: empty pages skipped and pages labeled, pages drawn clipped, new seam
+#     allowance offset
+#  3: no alignment marks towards skipped pages
+RENDER_VERSION = 3
+
+
+def cache_key(params):
+    data = json.dumps({"version": RENDER_VERSION, "params": params}, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class CacheWriter:
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.size = 0
+        # kept as long as the document is small enough for the memory tier
+        self.chunks = list()
+        self.f = None
+
+        if cache.directory is not None:
+            fd, self.tmp = tempfile.mkstemp(dir=cache.directory, prefix=".tmp-")
+            self.f = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        self.size += len(data)
+        if self.chunks is not None:
+            if self.size <= self.cache.max_memory_item:
+                self.chunks.append(bytes(data))
+            else:
+                self.chunks = None
+        if self.f is not None:
+            self.f.write(data)
+
+    def commit(self):
+        if self.chunks is not None:
+            self.cache.memory.put(self.key, b"".join(self.chunks))
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+            os.replace(self.tmp, self.cache._path(self.key))
+            self.cache.evict()
+
+    def discard(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+            os.remove(self.tmp)
+
+
+class RenderCache:
+    def __init__(self, directory=None, max_disk_bytes=256 * 1024**2, max_memory_entries=32, max_memory_item=4 * 1024**2):
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_item = max_memory_item
+        self.memory = LRUCache(max_memory_entries)
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        data = self.memory.get(key)
+        if data is not None:
+            return data
+
+        if self.directory is None:
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # the modification time doubles as last access time for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        if len(data) <= self.max_memory_item:
+            self.memory.put(key, data)
+        return data
+
+    def get_path(self, key):
+        if self.directory is None:
+            return None
+
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def writer(self, key):
+        return CacheWriter(self, key)
+
+    def put(self, key, data):
+        if len(data) <= self.max_memory_item:
+            self.memory.put(key, data)
+
+        if self.directory is None:
+            return
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+
+        self.evict()
+
+    def evict(self):
+        entries = list()
+        total = 0
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if not e.is_file():
+                    continue
+                try:
+                    st = e.stat()
+                    # left behind by a worker that died while rendering
+                    if e.name.startswith(".tmp-"):
+                        if now - st.st_mtime > 3600:
+                            os.remove(e.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, e.path))
+                total += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
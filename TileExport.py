@@ -0,0 +1,133 @@
+""" ChuteMaker
+Copyright (C) 2022 Thomas Schmid
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import io
+import json
+import zipfile
+
+import cairo
+
+import util
+from util import TILE_TYPES
+from CairoTiler import CairoTiler
+
+# per worker process state, set up once by _init_worker
+_tiler = None
+_typ = None
+_dpi = None
+
+
+def make_tiler(chute, paper_size, margins=(10, 10, 10, 10), overlap=10):
+    # every page is drawn with chute.draw, so no pattern is recorded
+    return CairoTiler(None, chute.get_document_size(), paper_size, margins, overlap,
+                      outline=chute.get_cut_lines(), draw=chute.draw)
+
+
+def _init_worker(make_chute, spec, paper_size, margins, overlap, typ, dpi):
+    # cairo contexts can not be sent to other processes, so every worker
+    # builds the chute once and renders all its pages from it
+    global _tiler, _typ, _dpi
+    _tiler = make_tiler(make_chute(spec), paper_size, margins, overlap)
+    _typ = typ
+    _dpi = dpi
+
+
+def render_tile(tiler, page, typ="png", dpi=150):
+    if typ not in TILE_TYPES:
+        raise ValueError(f"unknown tile type {typ}")
+
+    f = io.BytesIO()
+    width = util.mm_to_pt(tiler.paper_size[0])
+    height = util.mm_to_pt(tiler.paper_size[1])
+
+    if typ == "svg":
+        surface = cairo.SVGSurface(f, width, height)
+        ctx = cairo.Context(surface)
+    else:
+        scale = dpi / 72
+        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, round(width * scale), round(height * scale))
+        ctx = cairo.Context(surface)
+        ctx.set_source_rgb(1, 1, 1)
+        ctx.paint()
+        ctx.scale(scale, scale)
+
+    tiler.render_page(ctx, page)
+    if typ == "png":
+        surface.write_to_png(f)
+    surface.finish()
+    return f.getvalue()
+
+
+def _render_tile(page):
+    return (page, render_tile(_tiler, page, _typ, _dpi))
+
+
+def tile_name(page, typ):
+    return f"tile_c{page[0] + 1:02d}_r{page[1] + 1:02d}.{typ}"
+
+
+def export_tiles(make_chute, spec, output, paper_size, typ="png", dpi=150,
+                 margins=(10, 10, 10, 10), overlap=10, jobs=None):
+    # Renders every non-empty page of the tiled pattern as its own file, in
+    # parallel, into the zip archive output together with a page map
+    # pages.json. make_chute(spec) must be picklable and build the chute.
+    # the page layout only needs the geometry, the workers draw the pages
+    chute = make_chute(spec)
+    tiler = CairoTiler(None, chute.get_document_size(), paper_size, margins, overlap,
+                       outline=chute.get_cut_lines())
+    n, m = tiler.page_grid()
+    layout = list(tiler.pages())
+    pages = [page for page in layout if not page[4]]
+    tiles = list()
+
+    with zipfile.ZipFile(output, "w") as archive, ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_init_worker,
+            initargs=(make_chute, spec, paper_size, margins, overlap, typ, dpi)) as executor:
+        futures = [executor.submit(_render_tile, page) for page in pages]
+        for future in as_completed(futures):
+            page, data = future.result()
+            name = tile_name(page, typ)
+            # png is compressed already
+            archive.writestr(name, data, zipfile.ZIP_STORED if typ == "png" else zipfile.ZIP_DEFLATED)
+
+            i, j, xoff, yoff, _ = page
+            tiles.append({
+                "file": name,
+                "column": i + 1,
+                "row": j + 1,
+                "x": xoff,
+                "y": yoff,
+                "bytes": len(data)
+            })
+
+        tiles.sort(key=lambda tile: (tile["column"], tile["row"]))
+        page_map = {
+            "type": typ,
+            "dpi": dpi if typ == "png" else None,
+            "paper_size": list(paper_size),
+            "margins": list(margins),
+            "overlap": overlap,
+            "document_size": list(tiler.size),
+            "columns": n,
+            "rows": m,
+            "tiles": tiles,
+            "empty": [[i + 1, j + 1] for i, j, _, _, empty in layout if empty]
+        }
+        archive.writestr("pages.json", json.dumps(page_map, indent=2), zipfile.ZIP_DEFLATED)
+
+    return page_map
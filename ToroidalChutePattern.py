@@ -1,126 +1,153 @@
+import logging
 import math
 import numpy as np
 from ChutePattern import ChutePattern
+from ChuteSpec import ChuteSpec
 
-class ToroidalChutePattern(ChutePattern):
-    def __init__(self, diameter, num_panels, e, tangent_lines=True, line_length = None, spill_hole_diameter = 0, grid=True, seam_allowance=(10,10,10,10)):
-        self.line_length = line_length
-        self.diameter = diameter
-        self.spill_diamter = spill_hole_diameter
-        self.e = e
-        self.r = diameter/4 * e
-        self.rt = diameter/2 - self.r
-        self.rs = spill_hole_diameter/2
-        self.num_panels = num_panels
-        self.tangent_lines = tangent_lines
-        super().__init__(grid, seam_allowance)
-
-        self.line_lengths = dict()
-        self.line_lengths["A"] = self.line_length
-        self.calc_line_lenghts()
+log = logging.getLogger(__name__)
 
-    def description(self):
-        return {
-            "diameter": self.diameter,
-            "panels": self.num_panels,
-            "spill hole diameter": self.rs * 2,
-            "form factor": self.e,
-            "line length": "n/a" if not self.tangent_lines else f"A: {self.line_length:.0f}, B: {self.line_lengths['B']:.0f}, C: {self.line_lengths['C']:.0f}",
-            "seam allowance": self.seam_allowance
-        }
+# The functions below take scalars or NumPy arrays, so the pattern class and
+# the parameter sweeps in sweep.py share them. r is the radius of the torus
+# cross section, rt the distance of its center from the canopy axis.
 
-    def _t(self, x):
-        return math.acos((x-self.rt)/self.r)
+def torus_t(r, rt, x):
+    # clip round-off at the innermost point of the torus, x = rt - r
+    return np.arccos(np.clip((x-rt)/r, -1, 1))
 
-    def _x(self, t):
-        return self.rt + math.cos(t) * self.r
+def tangential_line_point(r, rt, line_length):
+    l = line_length
+    x = l*(l*rt + r*np.sqrt(l**2 + r**2 - rt**2))/(l**2 + r**2)
+    return torus_t(r, rt, x)
 
-    def _y(self, t):
-        return math.sin(t) * self.r
+def spill_radius(r, rt, rs):
+    minx = rt - r
+    return np.where(minx > rs, minx, np.where(rs >= rt, rt, rs))
 
-    def _tangential_line_point(self):
-        l = self.line_length
-        r = self.r
-        rt = self.rt
-        x = l*(l*rt + r*math.sqrt(l**2 + r**2 - rt**2))/(l**2 + r**2)
-        return self._t(x)
+def line_lengths(r, rt, rs, line_length):
+    tmin = -tangential_line_point(r, rt, line_length)
+    tmax = torus_t(r, rt, rs)
 
-    def get_spill_diameter(self):
+    xa1 = rt + np.cos(tmin) * r
+    ya1 = np.sin(tmin) * r
+    ya2 = ya1 - np.tan(tmin + np.pi/2) * xa1
+
+    xb1 = rt + np.cos(tmax) * r
+    yb1 = np.sin(tmax) * r
+    yb2 = yb1 - np.tan(tmax - np.pi/2) * xb1
+
+    has_bc = (tmax < np.pi) & (tmax > np.pi/2)
+    lb = np.where(has_bc, np.sqrt(xb1**2 + (yb1 - yb2)**2), 0)
+    lc = np.where(has_bc, np.abs(yb2 - ya2), 0)
+
+    return (lb, lc)
+
+class ToroidalSpec(ChuteSpec):
+    __slots__ = ()
+    kind = "toroidal"
+
+    def validate(self):
+        if self.e >= 2:
+            raise ValueError("e must be smaller than 2 for a toroidal chute")
+
+    @property
+    def r(self):
+        return self.diameter/4 * self.e
+
+    @property
+    def rt(self):
+        return self.diameter/2 - self.r
+
+    @property
+    def spill_radius(self):
+        # the spill hole is clamped to the torus, and the warning logged, once
+        return self._derive("spill_radius", self._spill_radius)
+
+    def _spill_radius(self):
         minx = self.rt - self.r
+        rs = self.spill_hole_diameter/2
 
-        if (minx > self.rs):
+        if (minx > rs):
             rs = minx
-            print("WARNING: spill hole to small. Extend it to minimal possible size")
-        elif (self.rs >= self.rt):
-            print("WARNING: spill hole diameter to large. Scaling it down")
+            log.warning("spill hole too small, extended to the minimal diameter %.1f mm", 2 * rs)
+        elif (rs >= self.rt):
+            log.warning("spill hole too large, reduced to the maximal diameter %.1f mm", 2 * self.rt)
             rs = self.rt
-        else:
-            rs = self.rs
 
         return rs
 
-    def calc_line_lenghts(self):
-        la = 0
-        lb = 0
-        lc = 0
-
-        rs = self.get_spill_diameter()
+    @property
+    def tangent_t(self):
+        return self._derive("tangent_t", lambda: float(tangential_line_point(self.r, self.rt, self.line_length)))
 
-        tmin = -self._tangential_line_point()
-        tmax = self._t(rs)
+    @property
+    def tmax(self):
+        return self._derive("tmax", lambda: float(torus_t(self.r, self.rt, self.spill_radius)))
 
-        xa1 = self._x(tmin)
-        ya1 = self._y(tmin)
-        m = math.tan(tmin + math.pi/2)
-        xa2 = 0
-        ya2 = ya1 - m * xa1
+    @property
+    def line_lengths(self):
+        if not self.tangent_lines:
+            return dict()
+        return dict(self._derive("line_lengths", self._line_lengths))
 
-        print(f"A1: x {xa1}, y {ya1}")
-        print(f"A2: x {xa2}, y {ya2}")
+    def _line_lengths(self):
+        lb, lc = line_lengths(self.r, self.rt, self.spill_radius, self.line_length)
+        return {"A": self.line_length, "B": float(lb), "C": float(lc)}
 
-        if tmax < math.pi and tmax > math.pi/2:
-            xb1 = self._x(tmax)
-            yb1 = self._y(tmax)
-            m = math.tan(tmax - math.pi/2)
-
-            xb2 = 0
-            yb2 = yb1 - m * xb1
+class ToroidalChutePattern(ChutePattern):
+    def __init__(self, diameter, num_panels, e, tangent_lines=True, line_length = None, spill_hole_diameter = 0, grid=True, seam_allowance=(10,10,10,10), tolerance=0.1, spec=None):
+        if spec is None:
+            spec = ToroidalSpec(diameter, num_panels, e, tangent_lines, line_length, spill_hole_diameter)
+        self.spec = spec
+
+        self.line_length = spec.line_length
+        self.diameter = spec.diameter
+        self.spill_diamter = spec.spill_hole_diameter
+        self.e = spec.e
+        self.r = spec.r
+        self.rt = spec.rt
+        self.rs = spec.spill_hole_diameter/2
+        self.num_panels = spec.num_panels
+        self.tangent_lines = spec.tangent_lines
+        super().__init__(grid, seam_allowance, tolerance)
 
-            lb = math.sqrt((xb1 - xb2)**2 + (yb1 - yb2)**2)
-            lc = math.sqrt((yb2 - ya2)**2)
+    def description(self):
+        return {
+            "diameter": self.diameter,
+            "panels": self.num_panels,
+            "spill hole diameter": self.rs * 2,
+            "form factor": self.e,
+            "line length": "n/a" if not self.tangent_lines else f"A: {self.line_length:.0f}, B: {self.spec.line_lengths['B']:.0f}, C: {self.spec.line_lengths['C']:.0f}",
+            "seam allowance": self.seam_allowance
+        }
 
-        self.line_lengths["B"] = lb
-        self.line_lengths["C"] = lc
+    def get_line_lengths(self):
+        return self.spec.line_lengths
 
-    def _get_pattern_path(self):
-        rs = self.get_spill_diameter()
+    def _t(self, x):
+        return torus_t(self.r, self.rt, x)
 
-        tmin = 0
+    def _x(self, t):
+        return self.rt + np.cos(t) * self.r
 
-        if self.tangent_lines:
-            tmin = -self._tangential_line_point()
+    def _y(self, t):
+        return np.sin(t) * self.r
 
-        tmax = self._t(rs)
-        n = 100
-        ts = np.linspace(tmin, tmax, n)
-        x = [self._x(t) for t in ts]
-        l = [(t-tmin) * self.r for t in ts]
+    def _edge(self, ts, tmin):
+        u = math.pi * self._x(ts) / self.num_panels
+        l = (ts - tmin) * self.r
 
-        u = np.array([math.pi*xe for xe in x]) / self.num_panels
+        return (u, l)
 
-        right_x = u
-        right_y = l
+    def _tangential_line_point(self):
+        return self.spec.tangent_t
 
-        left_x = [-e for e in u[::-1]]
-        left_y = [e for e in l[::-1]]
+    def get_spill_diameter(self):
+        return self.spec.spill_radius
 
-        top_x = [right_x[-1], left_x[0]]
-        top_y = [right_y[-1], left_y[0]]
+    def _geometry_key(self):
+        return self.spec
 
-        bottom_x = [left_x[-1], right_x[0]]
-        bottom_y = [left_y[-1], right_y[0]]
+    def _get_pattern_path(self):
+        u, l = self._sample_edge(self.spec.tmin, self.spec.tmax)
 
-        return {"right": zip(right_x, right_y),
-                "top": zip(top_x, top_y),
-                "left" : zip(left_x, left_y),
-                "bottom": zip(bottom_x, bottom_y)}
+        return self._gore_edges(u, l)
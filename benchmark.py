@@ -0,0 +1,305 @@
+""" ChuteMaker
+Copyright (C) 2022 Thomas Schmid
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Times every stage of pattern generation separately for a grid of cases and
+# appends the results to a JSON history, so that runs of different versions
+# can be compared. Every case runs in a fresh process, which makes the
+# reported peak RSS that of the case alone.
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+QUICK = {
+    "type": ["spherical", "toroidal"],
+    "diameter": [1500],
+    "panels": [12],
+    "joint_style": ["none", "miter"],
+    "seam_allowance": ["10", "10,20,0,15"],
+    "grid": [False, True],
+    "typ": ["pdf", "svg"],
+    "paper_size": [None, "A4"]
+}
+
+FULL = {
+    "type": ["spherical", "toroidal"],
+    "diameter": [500, 1500, 4000],
+    "panels": [6, 12, 24],
+    "joint_style": ["none", "bevel", "miter", "round"],
+    "seam_allowance": ["10", "10,20,0,15"],
+    "grid": [False, True],
+    "typ": ["pdf", "svg", "png", "dxf"],
+    "paper_size": [None, "A4", "A0"]
+}
+
+
+# command lines whose start up time is measured, none of them needs to render
+STARTUP = {
+    "help": ["--help"],
+    "invalid paper size": ["--paper_size=B7", "spherical", "--diameter=1000", os.devnull],
+    "toroidal metrics": ["--metrics_only", "toroidal", "--diameter=1000", os.devnull],
+    "spherical metrics": ["--metrics_only", "spherical", "--diameter=1000", os.devnull]
+}
+
+
+def cases(grid):
+    keys = list(grid.keys())
+    for values in itertools.product(*grid.values()):
+        case = dict(zip(keys, values))
+        # tiled output is always pdf
+        if case["paper_size"] and case["typ"] != "pdf":
+            continue
+        yield case
+
+
+def case_name(case):
+    return " ".join(str(v) for v in case.values())
+
+
+def clear_caches():
+    import ChutePattern
+    ChutePattern._outline_cache.clear()
+    ChutePattern._seam_cache.clear()
+    ChutePattern._pattern_cache.clear()
+
+
+def timed(f, repeat):
+    # best and mean of repeat runs, each with cold stage caches
+    times = list()
+    for _ in range(repeat):
+        t = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t)
+    return {"best": min(times), "mean": sum(times) / len(times)}
+
+
+def run_case(case, repeat):
+    import chutemaker
+    import ChutePattern
+    # modules the stages import on first use, so that no timed stage pays for
+    # an import even with --repeat=1
+    import EllipticalChutePattern
+    import ToroidalChutePattern
+    import PlotterExport
+    from scipy import special
+    if case["typ"] != "dxf":
+        import cairo
+        import CairoTiler
+        import RasterExport
+
+    spec = {k: v for k, v in case.items() if k not in ("typ", "paper_size")}
+    chute = chutemaker.make_chute(spec)
+    stages = dict()
+
+    def path():
+        clear_caches()
+        chute._get_pattern_path()
+    stages["path"] = timed(path, repeat)
+
+    def offset():
+        ChutePattern._seam_cache.clear()
+        chute.get_seam_polygon()
+    chute.get_outline()
+    stages["offset"] = timed(offset, repeat)
+
+    record = case["typ"] in ("pdf", "svg", "png")
+    if record:
+        def recording():
+            ChutePattern._pattern_cache.clear()
+            chute.get_pattern()
+        stages["record"] = timed(recording, repeat)
+
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "output." + case["typ"])
+
+        def encode():
+            chutemaker.render(chute, output, case["typ"], case["paper_size"])
+        stages["tile" if case["paper_size"] else "encode"] = timed(encode, repeat)
+        size = os.path.getsize(output)
+
+    return {
+        "case": case,
+        "stages": stages,
+        "total": sum(s["best"] for s in stages.values()),
+        "bytes": size,
+        "samples": chute.sampling.get("samples"),
+        # kB on Linux
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+
+def _run_case(case, repeat, connection):
+    try:
+        connection.send(run_case(case, repeat))
+    except Exception as e:
+        connection.send({"case": case, "error": f"{type(e).__name__}: {e}"})
+    connection.close()
+
+
+def run_isolated(case, repeat):
+    ctx = multiprocessing.get_context("spawn")
+    receiver, sender = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_run_case, args=(case, repeat, sender))
+    process.start()
+    result = receiver.recv()
+    process.join()
+    return result
+
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def import_times(stderr):
+    # cumulative import time in s of every top level import in the output of
+    # python -X importtime
+    times = dict()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def run_startup(arguments, repeat):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "chutemaker.py")] + arguments
+
+    times = list()
+    for _ in range(repeat):
+        t = time.perf_counter()
+        subprocess.run(command, capture_output=True)
+        times.append(time.perf_counter() - t)
+
+    imports = import_times(subprocess.run(command[:1] + ["-X", "importtime"] + command[1:],
+                                          capture_output=True, text=True).stderr)
+    return {
+        "best": min(times),
+        "imports": sum(imports.values()),
+        "slowest imports": dict(sorted(imports.items(), key=lambda i: -i[1])[:5])
+    }
+
+
+def previous_results(history, key="results"):
+    runs = [run for run in history if key in run]
+    if not runs:
+        return dict()
+    if key == "startup":
+        return runs[-1]["startup"]
+    return {case_name(r["case"]): r for r in runs[-1]["results"] if "error" not in r}
+
+
+def startup(args, history):
+    previous = previous_results(history, "startup")
+
+    results = dict()
+    for name, arguments in STARTUP.items():
+        result = run_startup(arguments, args.repeat)
+        results[name] = result
+
+        change = ""
+        if name in previous:
+            change = f" ({100 * (result['best'] / previous[name]['best'] - 1):+.0f} %)"
+        slowest = ", ".join(f"{k} {1000 * v:.0f}" for k, v in result["slowest imports"].items())
+        print(f"{name:20s} {1000 * result['best']:7.1f} ms{change}  imports {1000 * result['imports']:7.1f} ms: {slowest}")
+
+    return results
+
+
+def main(args):
+    history = list()
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            history = json.load(f)
+    run = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": args.repeat
+    }
+
+    if args.startup:
+        run["startup"] = startup(args, history)
+        history.append(run)
+        with open(args.history, "w") as f:
+            json.dump(history, f, indent=1)
+        return
+
+    previous = previous_results(history)
+    results = list()
+    for case in cases(FULL if args.full else QUICK):
+        name = case_name(case)
+        if args.filter and args.filter not in name:
+            continue
+
+        result = run_isolated(case, args.repeat)
+        results.append(result)
+        if "error" in result:
+            print(f"{name:55s} ERROR: {result['error']}")
+            continue
+
+        stages = " ".join(f"{k} {1000 * v['best']:7.1f}" for k, v in result["stages"].items())
+        change = ""
+        if name in previous:
+            change = f" ({100 * (result['total'] / previous[name]['total'] - 1):+.0f} %)"
+        print(f"{name:55s} {stages}  total {1000 * result['total']:7.1f} ms{change}  {result['bytes'] / 1024:8.0f} kB  {result['peak_rss'] / 1024:5.0f} MB")
+
+    run["results"] = results
+    history.append(run)
+    with open(args.history, "w") as f:
+        json.dump(history, f, indent=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=
+        "Time path sampling, seam allowance, recording, encoding and tiling for a grid of chutes. Times are in ms, the change is relative to the last run in the history"
+    )
+    parser.add_argument(
+        "--startup",
+        action="store_true",
+        help=
+        "Measure the start up time of the command line tool and its slowest imports (python -X importtime) instead")
+    parser.add_argument("--full",
+                        action="store_true",
+                        help="Run all combinations instead of a quick subset")
+    parser.add_argument("--repeat",
+                        "-r",
+                        type=int,
+                        default=3,
+                        help="Runs per stage, the best one is reported")
+    parser.add_argument("--filter",
+                        "-k",
+                        help="Only run cases whose name contains this text")
+    parser.add_argument("--history",
+                        default="benchmark_history.json",
+                        help="JSON file the results are appended to")
+    main(parser.parse_args())
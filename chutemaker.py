@@ -14,19 +14,52 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
-from ChutePattern import MitreType
-import argparse
+# cairo, shapely, numpy and scipy are only imported by the functions that
+# need them, so that --help and argument errors don't wait for them
 
-import cairo
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
 
+import instrumentation
 import util
-from ToroidalChutePattern import ToroidalChutePattern
-from EllipticalChutePattern import EllipticChutePattern
-from CairoTiler import CairoTiler, PAPER_SIZES
+from instrumentation import stage
+from util import PAPER_SIZES, TILE_TYPES, RASTER_TYPES, PLOTTER_TYPES
 
 
-def main(chute, args):
+def render(chute, output, typ="pdf", paper_size=None, dpi=150):
+    if typ in PLOTTER_TYPES:
+        from PlotterExport import chute_layers, write_plotter
+        layers = chute_layers(chute)
+        with stage("plotter"):
+            write_plotter(layers, output, typ)
+        return
+
     pattern, size = chute.get_pattern()
+    return write_pattern(pattern, size, output, typ, paper_size,
+                         chute.get_cut_lines(), chute.draw, dpi)
+
+
+def write_pattern(pattern,
+                  size,
+                  output,
+                  typ="pdf",
+                  paper_size=None,
+                  outline=None,
+                  draw=None,
+                  dpi=150):
+    import cairo
+    from CairoTiler import CairoTiler
+    from RasterExport import RasterExporter
+
+    if typ in RASTER_TYPES:
+        with stage("raster"):
+            RasterExporter(pattern, size, dpi, draw=draw).export(output, typ)
+        return
 
     surface = cairo.RecordingSurface(
         cairo.CONTENT_COLOR_ALPHA,
@@ -37,51 +70,348 @@ def main(chute, args):
     ctx.paint()
     pattern2 = ctx.pop_group()
 
+    if paper_size:
+        tiler = CairoTiler(pattern2,
+                           size,
+                           overlap=10,
+                           paper_size=PAPER_SIZES[paper_size],
+                           outline=outline,
+                           draw=draw)
+        return tiler.tile(output)
+    else:
+        if typ == "svg":
+            surface = cairo.SVGSurface(output, util.mm_to_pt(size[0]),
+                                       util.mm_to_pt(size[1]))
+        elif typ == "pdf":
+            surface = cairo.PDFSurface(output, util.mm_to_pt(size[0]),
+                                       util.mm_to_pt(size[1]))
+        else:
+            raise ValueError(f"unknown output type {typ}")
+
+        with stage("encode"):
+            ctx = cairo.Context(surface)
+            ctx.set_source(pattern2)
+            ctx.paint()
+            surface.finish()
+
+
+def write_metrics(chute, output):
+    metrics = json.dumps(chute.metrics(), indent=2)
+
+    if output == "-":
+        print(metrics)
+    else:
+        with open(output, "w") as f:
+            f.write(metrics)
+
+
+def parse_thumbnail_size(value):
+    # "256" or "320x200", in pixels
+    size = [int(v) for v in str(value).lower().split("x")]
+    if len(size) == 1:
+        size = size * 2
+    if len(size) != 2 or min(size) < 1:
+        raise ValueError("thumbnail size needs one value or WIDTHxHEIGHT in pixels")
+    return size
+
+
+def write_thumbnail(chute, output, size):
+    from RasterExport import thumbnail
+
+    chute.set_grid(False)
+    with open(output, "wb") as f:
+        f.write(thumbnail(chute, *size))
+
+
+def main(spec, args):
+    if args.metrics_only:
+        write_metrics(make_chute(spec), args.output)
+        return
+
+    if args.thumbnail:
+        write_thumbnail(make_chute(spec), args.output, parse_thumbnail_size(args.thumbnail))
+        return
+
     if args.paper_size:
         if args.typ == "svg":
             print(
                 "ERROR: svg does not support multiple pages. Don't specify a paper size if you want to export svg file"
             )
+        if args.typ in RASTER_TYPES:
+            print(
+                "ERROR: raster output has no pages. Use --tiles to export tiled pages as images"
+            )
+            return
+        if args.typ in PLOTTER_TYPES:
+            print("ERROR: plotter output has no pages")
+            return
         if args.paper_size not in PAPER_SIZES.keys():
             print(args.paper_size)
             print("Known Paper Sizes:")
             print(PAPER_SIZES)
             return
-        tiler = CairoTiler(pattern2,
-                           size,
-                           overlap=10,
-                           paper_size=PAPER_SIZES[args.paper_size])
-        tiler.tile(args.output)
+
+    if args.tiles:
+        if not args.paper_size:
+            print("ERROR: tile export needs a paper size")
+            return
+        from TileExport import export_tiles
+        with stage("tiles"):
+            page_map = export_tiles(make_chute, spec, args.output,
+                                    PAPER_SIZES[args.paper_size], args.tiles,
+                                    args.dpi, jobs=args.tile_jobs)
+        print(
+            f"{len(page_map['tiles'])} tiles, skipped {len(page_map['empty'])} empty pages"
+        )
+        return
+
+    chute = make_chute(spec)
+
+    if args.nest:
+        from GoreNester import GoreNester
+        from PlotterExport import nested_layers, write_plotter
+        nester = GoreNester(chute, args.nest, spacing=args.nest_spacing)
+        if args.typ in PLOTTER_TYPES:
+            layers = nested_layers(nester)
+            with stage("plotter"):
+                write_plotter(layers, args.output, args.typ)
+            print(
+                f"marker length: {nester.length:.0f} mm, utilization: {100 * nester.utilization():.1f} %"
+            )
+            return
+
+        pattern, size = nester.get_marker()
+        write_pattern(pattern,
+                      size,
+                      args.output,
+                      args.typ,
+                      args.paper_size,
+                      dpi=args.dpi)
+        print(
+            f"marker length: {nester.length:.0f} mm, utilization: {100 * nester.utilization():.1f} %"
+        )
+        return
+
+    stats = render(chute, args.output, args.typ, args.paper_size, args.dpi)
+    if stats and stats["empty pages"]:
+        print(
+            f"{stats['pages']} pages, skipped {stats['empty pages']} empty pages (about {stats['bytes saved'] / 1024:.0f} kB)"
+        )
+
+
+def parse_seam_allowance(value):
+    if isinstance(value, (list, tuple)):
+        seam_allowance = [float(e) for e in value]
     else:
-        if args.typ == "svg":
-            surface = cairo.SVGSurface(args.output, util.mm_to_pt(size[0]),
-                                       util.mm_to_pt(size[1]))
-        elif args.typ == "pdf":
-            surface = cairo.PDFSurface(args.output, util.mm_to_pt(size[0]),
-                                       util.mm_to_pt(size[1]))
+        seam_allowance = [float(e) for e in str(value).split(",")]
+
+    if len(seam_allowance) == 1:
+        seam_allowance = seam_allowance * 4
+    if len(seam_allowance) != 4:
+        raise ValueError(
+            "seam allowance needs one value or four values for RIGHT,TOP,LEFT,BOTTOM edges"
+        )
+
+    return seam_allowance
 
-        ctx = cairo.Context(surface)
-        ctx.set_source(pattern2)
-        ctx.paint()
+
+def make_spec(spec):
+    # normalizes and validates the geometry of a spec, cheap enough to run for
+    # every row of a batch before anything is rendered
+    from ToroidalChutePattern import ToroidalSpec
+    from EllipticalChutePattern import SphericalSpec
+
+    diameter = float(spec["diameter"])
+    spill_diameter = spec.get("spill_diameter")
+    args = (diameter, int(spec.get("panels", 8)), float(spec.get("e", 0.7)),
+            True, spec.get("line_length"))
+
+    if spec["type"] == "spherical":
+        return SphericalSpec(*args, spill_diameter if spill_diameter is not None else 0.1 * diameter)
+    elif spec["type"] == "toroidal":
+        return ToroidalSpec(*args, spill_diameter)
+    else:
+        raise ValueError(f"unknown chute type {spec['type']}")
+
+
+def make_chute(spec):
+    from ChutePattern import MitreType
+    from ToroidalChutePattern import ToroidalChutePattern
+    from EllipticalChutePattern import EllipticChutePattern
+
+    chute_spec = make_spec(spec)
+    grid = spec.get("grid", False)
+    seam_allowance = parse_seam_allowance(spec.get("seam_allowance", 10))
+    tolerance = float(spec.get("tolerance", 0.1))
+
+    cls = EllipticChutePattern if spec["type"] == "spherical" else ToroidalChutePattern
+    chute = cls.from_spec(chute_spec, grid, seam_allowance, tolerance)
+    chute.set_joint_style(MitreType[spec.get("joint_style", "none")])
+    return chute
+
+
+def chute_spec(args, chute_type, e):
+    return {
+        "type": chute_type,
+        "diameter": args.diameter,
+        "panels": args.panels,
+        "e": e,
+        "line_length": args.line_length,
+        "spill_diameter": args.spill_diameter,
+        "grid": args.grid,
+        "seam_allowance": args.seam_allowance,
+        "joint_style": args.joint_style,
+        "tolerance": args.tolerance
+    }
 
 
 def spherical(args):
-    chute = EllipticChutePattern(
-        args.diameter, args.panels, args.excentricity, True,
-        args.line_length if args.line_length else 2 * args.diameter,
-        args.spill_diameter if args.spill_diameter is not None else 0.1 *
-        args.diameter, args.grid, args.seam_allowance)
-    chute.set_joint_style(MitreType[args.joint_style])
-    main(chute, args)
+    main(chute_spec(args, "spherical", args.excentricity), args)
 
 
 def toroidal(args):
-    chute = ToroidalChutePattern(
-        args.diameter, args.panels, args.form_factor, True,
-        args.line_length if args.line_length else 2 * args.diameter,
-        args.spill_diameter, args.grid, args.seam_allowance)
-    chute.set_joint_style(MitreType[args.joint_style])
-    main(chute, args)
+    main(chute_spec(args, "toroidal", args.form_factor), args)
+
+
+BATCH_ALIASES = {
+    "excentricity": "e",
+    "form_factor": "e"
+}
+
+
+def batch_spec(row, defaults):
+    if not isinstance(row, dict):
+        raise ValueError(f"expected an object, got {type(row).__name__}")
+
+    spec = dict(defaults)
+    for k, v in row.items():
+        if k is None:
+            raise ValueError("more values than columns")
+        if v is None or v == "":
+            continue
+        k = k.strip()
+        spec[BATCH_ALIASES.get(k, k)] = v
+    if "grid" in spec and isinstance(spec["grid"], str):
+        spec["grid"] = spec["grid"].strip().lower() in ("1", "true", "yes", "y")
+    return spec
+
+
+def read_batch(path, defaults):
+    # (line, spec, error) for every row. A row that can't be read has no spec
+    # and an error, so that it is reported instead of aborting the batch
+    rows = list()
+
+    with open(path, newline="") as f:
+        if path.endswith(".jsonl"):
+            for i, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    rows.append((i, batch_spec(json.loads(line), defaults), None))
+                except ValueError as e:
+                    rows.append((i, None, f"{type(e).__name__}: {e}"))
+        else:
+            reader = csv.DictReader(f)
+            for row in reader:
+                try:
+                    rows.append((reader.line_num, batch_spec(row, defaults), None))
+                except ValueError as e:
+                    rows.append((reader.line_num, None, f"{type(e).__name__}: {e}"))
+
+    return rows
+
+
+def render_batch_item(index, spec, output_dir):
+    start = time.perf_counter()
+    typ = spec.get("typ", "pdf")
+    name = spec.get("name", f"{index:04d}_{spec.get('type')}_{spec.get('diameter')}")
+    item = {"index": index, "name": name, "spec": spec, "output": None, "error": None}
+
+    try:
+        paper_size = spec.get("paper_size")
+        if paper_size and paper_size not in PAPER_SIZES:
+            raise ValueError(f"unknown paper size {paper_size}")
+        if paper_size:
+            typ = "pdf"
+        output = os.path.join(output_dir, name + "." + typ)
+        chute = make_chute(spec)
+        render(chute, output, typ, paper_size, float(spec.get("dpi", 150)))
+        item["output"] = output
+
+        if spec.get("thumbnail"):
+            item["thumbnail"] = os.path.join(output_dir, name + ".thumbnail.png")
+            write_thumbnail(chute, item["thumbnail"], parse_thumbnail_size(spec["thumbnail"]))
+    except Exception as e:
+        item["error"] = f"{type(e).__name__}: {e}"
+
+    item["seconds"] = time.perf_counter() - start
+    return item
+
+
+def batch(args):
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    start = time.perf_counter()
+    os.makedirs(args.output, exist_ok=True)
+    defaults = {
+        "panels": args.panels,
+        "grid": args.grid,
+        "typ": args.typ,
+        "joint_style": args.joint_style,
+        "seam_allowance": args.seam_allowance,
+        "tolerance": args.tolerance,
+        "paper_size": args.paper_size,
+        "dpi": args.dpi,
+        "thumbnail": args.thumbnail
+    }
+    rows = read_batch(args.specs, defaults)
+    items = list()
+
+    # unreadable rows and invalid geometry are reported without starting a
+    # worker for them
+    digests = dict()
+    for i, (line, spec, error) in enumerate(rows):
+        if error is None:
+            try:
+                digests[i] = make_spec(spec).digest()
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+        if error is not None:
+            item = {"index": i, "line": line, "name": spec.get("name") if spec else None, "spec": spec,
+                    "output": None, "error": error, "seconds": 0.0}
+            print(f"ERROR: item {i} (line {line}): {error}")
+            items.append(item)
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {
+            executor.submit(render_batch_item, i, spec, args.output): (i, spec)
+            for i, (_, spec, _) in enumerate(rows) if i in digests
+        }
+        for future in as_completed(futures):
+            try:
+                item = future.result()
+            except Exception as e:
+                i, spec = futures[future]
+                item = {"index": i, "name": None, "spec": spec, "output": None,
+                        "error": f"{type(e).__name__}: {e}", "seconds": None}
+            if item["error"]:
+                print(f"ERROR: item {item['index']}: {item['error']}")
+            item["line"] = rows[item["index"]][0]
+            item["digest"] = digests[item["index"]]
+            items.append(item)
+
+    items.sort(key=lambda item: item["index"])
+    manifest = {
+        "items": items,
+        "rendered": sum(1 for item in items if item["error"] is None),
+        "failed": sum(1 for item in items if item["error"] is not None),
+        "seconds": time.perf_counter() - start
+    }
+
+    with open(os.path.join(args.output, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"{manifest['rendered']} rendered, {manifest['failed']} failed in {manifest['seconds']:.1f} s")
 
 
 if __name__ == "__main__":
@@ -103,11 +433,11 @@ if __name__ == "__main__":
                         action="store_true",
                         help="Plot a grid")
     parser.add_argument("--typ",
-                        choices=["svg", "pdf"],
+                        choices=["svg", "pdf"] + list(RASTER_TYPES) + list(PLOTTER_TYPES),
                         default="pdf",
                         help="Output file format")
     parser.add_argument("--joint_style",
-                        choices=["bevel", "miter", "none", "box"],
+                        choices=["bevel", "miter", "none", "round"],
                         default="none")
     parser.add_argument(
         "--seam_allowance",
@@ -116,6 +446,52 @@ if __name__ == "__main__":
         help=
         "Length to offset gore pattern. Either specify a single value or a list of values for RIGHT,TOP,LEFT,BOTTOM edges"
     )
+    parser.add_argument(
+        "--metrics_only",
+        "--metrics-only",
+        action="store_true",
+        help=
+        "Write areas, seam and line lengths and the outline as JSON instead of rendering. Use - as output for stdout"
+    )
+    parser.add_argument(
+        "--nest",
+        type=float,
+        metavar="ROLL_WIDTH",
+        help=
+        "Lay out all panels on a roll of the given width and output the marker instead of a single gore"
+    )
+    parser.add_argument("--nest_spacing",
+                        type=float,
+                        default=5,
+                        help="Minimal distance between nested panels")
+    parser.add_argument(
+        "--tiles",
+        choices=TILE_TYPES,
+        help=
+        "Write every page as its own file into a zip archive with a page map pages.json instead of a single document. Needs --paper_size"
+    )
+    parser.add_argument(
+        "--thumbnail",
+        help=
+        "Write a PNG thumbnail of the outline without grid of at most this size in pixels (256 or 320x200) instead of the pattern. In batch mode thumbnails are written next to the patterns"
+    )
+    parser.add_argument("--dpi",
+                        type=float,
+                        default=150,
+                        help="Resolution of png and tiff output")
+    parser.add_argument(
+        "--tile_jobs",
+        type=int,
+        help="Number of processes rendering tiles. Default: all cores")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time spent in each stage to stderr")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Maximum deviation of the sampled gore outline from the exact curve")
 
     subparser = parser.add_subparsers(title="Chute Types")
 
@@ -143,16 +519,34 @@ if __name__ == "__main__":
     sub_toroidal.add_argument("--spill_diameter", "-s", type=float)
     sub_toroidal.set_defaults(func=toroidal)
 
+    sub_batch = subparser.add_parser(
+        "batch",
+        help=
+        "Render all chutes of a CSV or JSONL file into the output directory")
+    sub_batch.add_argument(
+        "specs",
+        help=
+        "CSV or JSONL file with one chute per row. Columns: type (spherical or toroidal), diameter, panels, e, line_length, spill_diameter, seam_allowance, joint_style, grid, typ, paper_size, dpi, tolerance, name. Missing columns default to the global options"
+    )
+    sub_batch.add_argument("--jobs",
+                           "-j",
+                           type=int,
+                           help="Number of worker processes. Default: all cores")
+    sub_batch.set_defaults(func=batch)
+
     parser.add_argument("output")
     args = parser.parse_args()
 
-    seam_allowance = list()
-    for e in args.seam_allowance.split(","):
-        seam_allowance.append(int(e))
-    args.seam_allowance = seam_allowance
+    args.seam_allowance = parse_seam_allowance(args.seam_allowance)
 
-    if len(args.seam_allowance) == 1:
-        sa = args.seam_allowance[0]
-        args.seam_allowance = [sa, sa, sa, sa]
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    if args.profile:
+        instrumentation.start_timing()
 
+    start = time.perf_counter()
     args.func(args)
+
+    if args.profile:
+        for name, (total, count) in instrumentation.profile(instrumentation.timings()).items():
+            print(f"{name:10s} {1000 * total:10.1f} ms {count:6d}x", file=sys.stderr)
+        print(f"{'total':10s} {1000 * (time.perf_counter() - start):10.1f} ms", file=sys.stderr)
@@ -0,0 +1,333 @@
+""" ChuteMaker
+Copyright (C) 2022 Thomas Schmid
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# ASGI variant of the /generate and /jobs routes of chutemaker_webapp.
+# Requests and the transfer of the documents to the clients are handled on one
+# asyncio event loop, the geometry, recording and encoding run in a bounded
+# pool of worker processes. A worker hands the document back in a shared
+# memory block, which the event loop sends in chunks and unlinks afterwards,
+# so the document is neither pickled nor held by a worker while a slow client
+# downloads it.
+#
+#   uvicorn chutemaker_asgi:app --host 0.0.0.0 --port 8000
+
+import _posixshmem
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from urllib.parse import parse_qsl
+
+# the event loop process only parses requests, the workers warm up themselves
+PRELOAD = os.environ.get("CHUTEMAKER_PRELOAD") != "0"
+os.environ["CHUTEMAKER_PRELOAD"] = "0"
+
+import chutemaker_webapp as webapp
+import instrumentation
+from instrumentation import ADMISSION, BYTES_OUT, CACHE, PAGES, REQUEST_SECONDS, STAGE_SECONDS
+
+WORKERS = int(os.environ.get("CHUTEMAKER_ASGI_WORKERS", os.cpu_count() or 1))
+# requests waiting for a worker before further ones are turned away with 503
+MAX_PENDING = int(os.environ.get("CHUTEMAKER_ASGI_QUEUE", 4 * WORKERS))
+CHUNK_SIZE = 256 * 1024
+# initial size of the shared memory block a worker renders into
+BLOCK_SIZE = 1024**2
+
+executor = None
+pending = 0
+
+
+def _shared_memory(size=0, name=None):
+    # The event loop unlinks the block once it is sent. The resource tracker
+    # must not remove it when the worker that created it exits, so no block
+    # is tracked and every one is removed with _unlink.
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, create=name is None, size=size, track=False)
+
+    shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _unlink(name):
+    # by name, so that a block is removed even if it can't be attached
+    try:
+        _posixshmem.shm_unlink("/" + name)
+    except FileNotFoundError:
+        pass
+
+
+def _release(shm):
+    shm.close()
+    _unlink(shm.name)
+
+
+def _discard_result(future):
+    # done callback of a render whose request went away
+    if not future.cancelled() and future.exception() is None:
+        _unlink(future.result()[0])
+
+
+def _init_worker(preload):
+    # the event loop sends what the workers render, a memory tier in a worker
+    # would never be read
+    webapp.render_cache.max_memory_item = 0
+    if preload:
+        webapp.warm_up()
+
+
+def _render(params, key):
+    # Runs in a worker, returns the name and size of the shared memory block
+    # holding the document and the stage timings for the Server-Timing header.
+    # Every chunk goes straight to the disk cache and into the block, which
+    # doubles in size when it is full.
+    instrumentation.start_timing()
+    cp = webapp.make_chute(params)
+    writer = webapp.render_cache.writer(key)
+    shm = _shared_memory(BLOCK_SIZE)
+    size = 0
+    try:
+        for chunk in webapp.stream_document(cp, params):
+            writer.write(chunk)
+            if size + len(chunk) > shm.size:
+                grown = _shared_memory(max(2 * shm.size, size + len(chunk)))
+                grown.buf[:size] = shm.buf[:size]
+                _release(shm)
+                shm = grown
+            shm.buf[size:size + len(chunk)] = chunk
+            size += len(chunk)
+        writer.commit()
+    except BaseException:
+        writer.discard()
+        _release(shm)
+        raise
+    shm.close()
+
+    return (shm.name, size, instrumentation.timings())
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            return body
+
+
+async def respond(send, status, headers=(), body=b""):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def respond_json(send, status, value):
+    await respond(send, status, [("content-type", "application/json")], json.dumps(value).encode("utf-8"))
+
+
+async def send_path(send, status, headers, path):
+    # reads and sends the file in chunks, off the event loop
+    loop = asyncio.get_running_loop()
+    with open(path, "rb") as f:
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers]})
+        chunk = await loop.run_in_executor(None, f.read, CHUNK_SIZE)
+        while True:
+            following = await loop.run_in_executor(None, f.read, CHUNK_SIZE) if chunk else b""
+            await send({"type": "http.response.body", "body": chunk, "more_body": bool(following)})
+            if not following:
+                return
+            chunk = following
+
+
+async def send_shared(send, status, headers, name, size):
+    # the block is unlinked on every path, also if it can't be attached or the
+    # client goes away
+    shm = None
+    try:
+        shm = _shared_memory(name=name)
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers]})
+        for position in range(0, size, CHUNK_SIZE):
+            end = min(position + CHUNK_SIZE, size)
+            await send({"type": "http.response.body", "body": bytes(shm.buf[position:end]),
+                        "more_body": end < size})
+        if size == 0:
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        if shm is not None:
+            shm.close()
+        _unlink(name)
+
+
+async def generate(scope, receive, send):
+    global pending
+
+    headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+    form = dict(parse_qsl((await read_body(receive)).decode("utf-8"), keep_blank_values=True))
+    try:
+        params = webapp.parse_form(form)
+    except ValueError as e:
+        await respond_json(send, 400, {"error": str(e)})
+        return 400
+    if params is None:
+        return 502
+    if params["file_type"] not in webapp.FILE_TYPES:
+        await respond(send, 400)
+        return 400
+    mime, ext = webapp.FILE_TYPES[params["file_type"]]
+    loop = asyncio.get_running_loop()
+
+    try:
+        decision, cost = webapp.admit(params)
+        cp = webapp.make_chute(params)
+    except ValueError as e:
+        # also margins that leave no room on the paper
+        await respond_json(send, 400, {"error": str(e)})
+        return 400
+    except Exception:
+        webapp.app.logger.exception("invalid chute parameters %s", params)
+        return 502
+
+    ADMISSION.inc(decision=decision)
+    if decision == "reject":
+        await respond_json(send, 413, {"error": "the document exceeds the render budget", "estimate": cost})
+        return 413
+    if decision == "queue":
+        job_id = await loop.run_in_executor(None, webapp.get_job_queue().submit, params, params["type"] + ext, mime)
+        await respond_json(send, 202, {"id": job_id, "status": f"/jobs/{job_id}", "estimate": cost})
+        return 202
+
+    key = webapp.output_key(cp, params)
+    response_headers = [("content-type", mime),
+                        ("content-disposition", f"attachment; filename={params['type'] + ext}"),
+                        ("etag", f'"{key}"'),
+                        ("cache-control", "no-cache")]
+    if f'"{key}"' in headers.get("if-none-match", ""):
+        await respond(send, 304, response_headers[2:])
+        return 304
+
+    # the workers cache documents on disk only, hits are streamed from there
+    path = await loop.run_in_executor(None, webapp.render_cache.get_path, key)
+    if path is not None:
+        CACHE.inc(result="disk")
+        BYTES_OUT.inc(os.path.getsize(path), endpoint="generate")
+        await send_path(send, 200, response_headers, path)
+        return 200
+
+    if pending >= MAX_PENDING:
+        await respond(send, 503, [("retry-after", "5")])
+        return 503
+
+    CACHE.inc(result="miss")
+    pending += 1
+    future = loop.run_in_executor(executor, _render, params, key)
+    try:
+        # shielded, so that the block of a render that finishes after its
+        # request was cancelled is still unlinked
+        name, size, timings = await asyncio.shield(future)
+    except asyncio.CancelledError:
+        future.add_done_callback(_discard_result)
+        raise
+    except Exception:
+        webapp.app.logger.exception("rendering failed for %s", params)
+        return 502
+    finally:
+        pending -= 1
+
+    # metrics of the workers stay in their processes, /metrics is rendered
+    # here from the stage timings they return
+    for stage, duration in timings:
+        STAGE_SECONDS.observe(duration, stage=stage)
+    PAGES.inc(sum(1 for stage, _ in timings if stage == "page"))
+    BYTES_OUT.inc(size, endpoint="generate")
+    response_headers.append(("server-timing", instrumentation.server_timing(timings)))
+    await send_shared(send, 200, response_headers, name, size)
+    return 200
+
+
+async def job(send, job_id, download):
+    # status and download of the jobs queued by generate, as in the webapp
+    loop = asyncio.get_running_loop()
+    queue = webapp.get_job_queue()
+    job = await loop.run_in_executor(None, queue.get, job_id)
+    if job is None or (download and job["status"] != "done"):
+        await respond(send, 404)
+        return 404
+
+    if not download:
+        await respond_json(send, 200, webapp.describe_job(job))
+        return 200
+
+    path = queue.artifact(job_id)
+    BYTES_OUT.inc(os.path.getsize(path), endpoint="jobs")
+    await send_path(send, 200, [("content-type", job["mime"]),
+                                ("content-disposition", f"attachment; filename={job['name']}")], path)
+    return 200
+
+
+async def lifespan(receive, send):
+    global executor
+
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # forkserver, so that no worker inherits the event loop or its threads
+            executor = ProcessPoolExecutor(max_workers=WORKERS,
+                                           mp_context=multiprocessing.get_context("forkserver"),
+                                           initializer=_init_worker,
+                                           initargs=(PRELOAD, ))
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            executor.shutdown(cancel_futures=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    start = time.perf_counter()
+    endpoint = None
+    if scope["path"] == "/generate" and scope["method"] == "POST":
+        endpoint = "generate"
+        status = await generate(scope, receive, send)
+        # generate answers everything but the failures
+        if status == 502:
+            await respond(send, status)
+    elif scope["path"].startswith("/jobs/") and scope["method"] == "GET":
+        endpoint = "jobs"
+        job_id, _, download = scope["path"][len("/jobs/"):].partition("/")
+        if download in ("", "download"):
+            status = await job(send, job_id, download == "download")
+        else:
+            status = 404
+            await respond(send, status)
+    elif scope["path"] == "/metrics":
+        endpoint = "metrics"
+        status = 200
+        await respond(send, status, [("content-type", "text/plain; version=0.0.4")],
+                      instrumentation.render_metrics().encode("utf-8"))
+    else:
+        status = 404
+        await respond(send, status)
+
+    REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, status=status)
@@ -14,159 +14,554 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
-from CairoTiler import PAPER_SIZES, CairoTiler
-from flask import Flask, render_template, request, Response, send_file
-from util import mm_to_pt
-import cairo
+from flask import Flask, render_template, request, Response, send_file, jsonify, g
+from util import mm_to_pt, LRUCache, PAPER_SIZES
 import io
+import json
+import multiprocessing
 import os
-from EllipticalChutePattern import EllipticChutePattern
-from ToroidalChutePattern import ToroidalChutePattern
+import struct
+import tempfile
+import time
+import numpy as np
+from EllipticalChutePattern import EllipticChutePattern, SphericalSpec
+from ToroidalChutePattern import ToroidalChutePattern, ToroidalSpec
 from ChutePattern import MitreType
+from RenderCache import RenderCache, cache_key
+from JobQueue import JobQueue
+import instrumentation
+from instrumentation import stage, ADMISSION, BYTES_OUT, CACHE, REQUEST_SECONDS
+from CostEstimate import estimate
 
 DEBUG = os.environ.get("DEBUG") is not None
 app = Flask(__name__)
 
+render_cache = RenderCache(
+    os.environ.get("CHUTEMAKER_CACHE_DIR",
+                   os.path.join(tempfile.gettempdir(), "chutemaker-cache")),
+    max_disk_bytes=int(os.environ.get("CHUTEMAKER_CACHE_SIZE", 256 * 1024**2)))
+
+job_queue = None
+
+spec_cache = LRUCache(256)
+# encoded /preview responses, a few kB each
+preview_cache = LRUCache(256)
+# PNG thumbnails, a few kB each
+thumbnail_cache = LRUCache(512)
+
+# Estimated cost up to which a document is rendered in the request. Beyond it
+# the grid is dropped if that is enough, otherwise the document is rendered as
+# background job if it stays within the job timeout. Documents with more pages
+# are always rejected.
+BUDGETS = {
+    "pages": int(os.environ.get("CHUTEMAKER_MAX_PAGES", 400)),
+    "seconds": float(os.environ.get("CHUTEMAKER_MAX_SECONDS", 5)),
+    "bytes": int(os.environ.get("CHUTEMAKER_MAX_BYTES", 64 * 1024**2)),
+    "job_seconds": float(os.environ.get("CHUTEMAKER_JOB_TIMEOUT", 300))
+}
+
 STATIC_CONTEXT = {
     "paper_sizes": PAPER_SIZES
 }
 
 
-def generateSVG(pattern, size):
-    f = io.BytesIO()
-
-    surface = cairo.SVGSurface(f, mm_to_pt(size[0]), mm_to_pt(size[1]))
-    ctx = cairo.Context(surface)
-
-    ctx.set_source(pattern)
-    ctx.paint()
+# cairo is imported by the functions that render, outlines, metrics and
+# previews don't need it
 
-    surface.finish()
-    f.seek(0)
-    return f
+def stream_surface(surface_type, pattern, size):
+    import cairo
+    from CairoTiler import ChunkWriter
 
+    writer = ChunkWriter()
 
-def generatePDF(pattern, size, tiling=False, paper_size="A4", margin=10):
-    f = io.BytesIO()
-
-    if not tiling:
-        surface = cairo.PDFSurface(f, mm_to_pt(size[0]), mm_to_pt(size[1]))
+    with stage("encode"):
+        surface = surface_type(writer, mm_to_pt(size[0]), mm_to_pt(size[1]))
         ctx = cairo.Context(surface)
 
         ctx.set_source(pattern)
         ctx.paint()
+
         surface.finish()
+    yield writer.drain()
+
+
+def streamSVG(pattern, size):
+    import cairo
+
+    return stream_surface(cairo.SVGSurface, pattern, size)
+
+
+def streamPDF(pattern, size, tiling=False, paper_size="A4", margin=10, outline=None, draw=None):
+    import cairo
+    from CairoTiler import CairoTiler
+
+    if not tiling:
+        return stream_surface(cairo.PDFSurface, pattern, size)
+
+    tiler = CairoTiler(pattern, size, PAPER_SIZES[paper_size],
+                       (margin, margin, margin, margin), outline=outline,
+                       draw=draw)
+    return tiler.stream()
+
+
+def generateSVG(pattern, size):
+    return io.BytesIO(b"".join(streamSVG(pattern, size)))
+
+
+def generatePDF(pattern, size, tiling=False, paper_size="A4", margin=10, outline=None, draw=None):
+    return io.BytesIO(b"".join(streamPDF(pattern, size, tiling, paper_size, margin, outline, draw)))
+
+
+FILE_TYPES = {
+    "svg": ("image/svg", ".svg"),
+    "pdf": ("application/pdf", ".pdf")
+}
+
+
+def parse_form(form):
+    diameter = form.get("diameter")
+    spill_diameter = form.get("spillDiameter")
+    e = form.get("e")
+    panels = form.get("panels")
+    tangentLines = form.get("tangentLines")
+    jointStyle = form.get("jointStyle")
+    line_length = form.get("lineLength")
+    tiling = form.get("tiling")
+    paper_size = form.get("paperSize")
+    margin = form.get("paperMargin")
+    fileType = form.get("typeSelect")
+    seamAllowance = form.get("seamAllowance")
+    grid = form.get("grid")
+    chute_type = form.get("type")
+
+    if any(
+            v is None for v in
+        [diameter, spill_diameter, e, panels, jointStyle, seamAllowance]):
+        return None
+
+    diameter = float(diameter)
+    spill_diameter = float(spill_diameter)
+    e = float(e)
+    panels = int(panels)
+    seamAllowance = float(seamAllowance)
+
+    grid = grid is not None
+
+    if tangentLines is not None:
+        tangentLines = bool(tangentLines)
+    else:
+        tangentLines = False
+
+    if tangentLines and line_length is not None:
+        line_length = float(line_length)
+        tangentLines = True
     else:
-        tiler = CairoTiler(pattern, size, PAPER_SIZES[paper_size],
-                           (margin, margin, margin, margin))
-        tiler.tile(f)
+        line_length = 2 * diameter
+        tangentLines = False
 
-    f.seek(0)
+    if not any([v is None for v in [tiling, paper_size, margin]]) and fileType == "pdf":
+        tiling = bool(tiling)
+        margin = float(margin)
+    else:
+        tiling = False
+        paper_size = None
+        margin = None
+
+    if jointStyle == "selectMitre":
+        jointStyle = MitreType.miter
+    elif jointStyle == "selectNone":
+        jointStyle = MitreType.none
+    else:
+        jointStyle = MitreType.bevel
+
+    return {
+        "type": chute_type,
+        "diameter": diameter,
+        "spill_diameter": spill_diameter,
+        "e": e,
+        "panels": panels,
+        "tangent_lines": tangentLines,
+        "line_length": line_length,
+        "seam_allowance": seamAllowance,
+        "joint_style": jointStyle.name,
+        "grid": grid,
+        "file_type": fileType,
+        "tiling": tiling,
+        "paper_size": paper_size,
+        "margin": margin
+    }
+
+
+def invalid_parameters(error):
+    # answer for form values that are no numbers or describe no chute
+    return jsonify({"error": str(error)}), 400
+
+
+def make_spec(params):
+    if params["type"] == "hemispherical":
+        spec_type = SphericalSpec
+    elif params["type"] == "toroidal":
+        spec_type = ToroidalSpec
+    else:
+        raise ValueError(f"unknown chute type {params['type']}")
 
-    return f
+    spec = spec_type(params["diameter"], params["panels"], params["e"],
+                     params["tangent_lines"], params["line_length"],
+                     params["spill_diameter"])
 
+    # reuse an equal spec from an earlier request, and with it the values
+    # already derived from it
+    known = spec_cache.get(spec)
+    if known is not None:
+        return known
+    spec_cache.put(spec, spec)
+    return spec
 
-@app.route("/generate", methods=["POST"])
-def spherical():
-    if request.method == "POST":
-        diameter = request.form.get("diameter")
-        spill_diameter = request.form.get("spillDiameter")
-        e = request.form.get("e")
-        panels = request.form.get("panels")
-        tangentLines = request.form.get("tangentLines")
-        jointStyle = request.form.get("jointStyle")
-        line_length = request.form.get("lineLength")
-        tiling = request.form.get("tiling")
-        paper_size = request.form.get("paperSize")
-        margin = request.form.get("paperMargin")
-        fileType = request.form.get("typeSelect")
-        seamAllowance = request.form.get("seamAllowance")
-        grid = request.form.get("grid")
-        chute_type = request.form.get("type")
-
-        if any(
-                v is None for v in
-            [diameter, spill_diameter, e, panels, jointStyle, seamAllowance]):
-            return Response(status=502)
 
-        diameter = float(diameter)
-        spill_diameter = float(spill_diameter)
-        e = float(e)
-        panels = int(panels)
-        seamAllowance = float(seamAllowance)
+def make_chute(params):
+    seam_allowance = (params["seam_allowance"], ) * 4
+    spec = make_spec(params)
 
-        grid = grid is not None
+    if params["type"] == "hemispherical":
+        cp = EllipticChutePattern.from_spec(spec, params["grid"], seam_allowance)
+    else:
+        cp = ToroidalChutePattern.from_spec(spec, params["grid"], seam_allowance)
 
-        if tangentLines is not None:
-            tangentLines = bool(tangentLines)
-        else:
-            tangentLines = False
+    cp.set_joint_style(MitreType[params["joint_style"]])
+    return cp
 
-        if tangentLines and line_length is not None:
-            line_length = float(line_length)
-            tangentLines = True
-        else:
-            line_length = 2 * diameter
-            tangentLines = False
 
-        if not any([v is None for v in [tiling, paper_size, margin]]):
-            tiling = bool(tiling)
-            margin = float(margin)
-        else:
-            tiling = False
+def estimate_cost(params):
+    paper_size = PAPER_SIZES[params["paper_size"]] if params["tiling"] else None
+    return estimate(make_spec(params), (params["seam_allowance"], ) * 4, params["joint_style"],
+                    params["grid"], params["file_type"], paper_size, params["margin"])
 
-        if jointStyle == "selectMitre":
-            jointStyle = MitreType.miter
-        elif jointStyle == "selectNone":
-            jointStyle = MitreType.none
-        else:
-            jointStyle = MitreType.bevel
 
+def admit(params):
+    # "render", "queue" or "reject", and the estimated cost
+    cost = estimate_cost(params)
+    if cost["pages"] > BUDGETS["pages"]:
+        return ("reject", cost)
+    if cost["seconds"] <= BUDGETS["seconds"] and cost["bytes"] <= BUDGETS["bytes"]:
+        return ("render", cost)
+
+    if cost["seconds"] <= BUDGETS["job_seconds"]:
+        return ("queue", cost)
+    return ("reject", cost)
+
+
+def output_key(cp, params):
+    return cache_key({
+        # the key holds the ChuteSpec, whose repr is stable
+        "pattern": repr(cp.pattern_key()),
+        "file_type": params["file_type"],
+        "tiling": params["tiling"],
+        "paper_size": params["paper_size"],
+        "margin": params["margin"]
+    })
+
+
+def stream_document(cp, params):
+    # geometry and recording happen here, only the encoding is streamed
+    pattern, size = cp.get_pattern()
+
+    if params["file_type"] == "svg":
+        return streamSVG(pattern, size)
+
+    return streamPDF(pattern, size, params["tiling"], params["paper_size"],
+                     params["margin"], cp.get_cut_lines(), cp.draw)
+
+
+def render(cp, params):
+    return b"".join(stream_document(cp, params))
+
+
+def render_job(params, path):
+    cp = make_chute(params)
+    with open(path, "wb") as f:
+        for chunk in stream_document(cp, params):
+            f.write(chunk)
+
+
+def get_job_queue():
+    # created on first use, so that no worker threads exist before uwsgi forks
+    global job_queue
+    if job_queue is None:
+        job_queue = JobQueue(
+            os.environ.get("CHUTEMAKER_JOBS_DIR",
+                           os.path.join(tempfile.gettempdir(), "chutemaker-jobs")),
+            render_job,
+            max_running=int(os.environ.get("CHUTEMAKER_JOBS", 2)),
+            timeout=BUDGETS["job_seconds"],
+            retention=float(os.environ.get("CHUTEMAKER_JOB_RETENTION", 3600)))
+    return job_queue
+
+
+def tee_to_cache(chunks, writer):
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+            BYTES_OUT.inc(len(chunk), endpoint="generate")
+            yield chunk
+        writer.commit()
+    finally:
+        writer.discard()
+
+
+@app.before_request
+def start_timing():
+    g.start = time.perf_counter()
+    instrumentation.start_timing()
+
+
+@app.after_request
+def server_timing(response):
+    # streamed documents are still being encoded when the response starts,
+    # their encoding shows up in /metrics only
+    duration = time.perf_counter() - g.start
+    REQUEST_SECONDS.observe(duration, endpoint=request.endpoint, status=response.status_code)
+
+    timings = instrumentation.timings() + [("total", duration)]
+    response.headers["Server-Timing"] = instrumentation.server_timing(timings)
+    return response
+
+
+@app.route("/metrics")
+def metrics():
+    return Response(instrumentation.render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/generate", methods=["POST"])
+def spherical():
+    if request.method == "POST":
         try:
-            if chute_type == "hemispherical":
-                cp = EllipticChutePattern(
-                    diameter,
-                    panels,
-                    e,
-                    tangentLines,
-                    line_length,
-                    spill_diameter,
-                    grid=grid,
-                    seam_allowance=(seamAllowance, seamAllowance,
-                                    seamAllowance, seamAllowance))
-            elif chute_type == "toroidal":
-                cp = ToroidalChutePattern(
-                    diameter,
-                    panels,
-                    e,
-                    tangentLines,
-                    line_length,
-                    spill_diameter,
-                    grid,
-                    seam_allowance=(seamAllowance, seamAllowance,
-                                    seamAllowance, seamAllowance))
-            cp.set_joint_style(jointStyle)
-        except Exception as e:
-            print(e)
+            params = parse_form(request.form)
+        except ValueError as e:
+            return invalid_parameters(e)
+        if params is None:
             return Response(status=502)
 
-        pattern, size = cp.get_pattern()
+        if params["file_type"] not in FILE_TYPES:
+            return Response(status=400)
+        mime, ext = FILE_TYPES[params["file_type"]]
+
+        try:
+            decision, cost = admit(params)
+            cp = make_chute(params)
+        except ValueError as e:
+            # also margins that leave no room on the paper
+            return invalid_parameters(e)
+        except Exception:
+            app.logger.exception("invalid chute parameters %s", params)
+            return Response(status=502)
 
-        if fileType == "svg":
-            f = generateSVG(pattern, size)
-            mime = "image/svg"
-            ext = ".svg"
-        elif fileType == "pdf":
-            f = generatePDF(pattern, size, tiling, paper_size, margin)
-            mime = "application/pdf"
-            ext = ".pdf"
+        ADMISSION.inc(decision=decision)
+        if decision == "reject":
+            return jsonify({"error": "the document exceeds the render budget", "estimate": cost}), 413
+
+        download_name = params["type"] + ext
+        if decision == "queue" or request.form.get("background") is not None:
+            job_id = get_job_queue().submit(params, download_name, mime)
+            return jsonify({"id": job_id, "status": f"/jobs/{job_id}", "estimate": cost}), 202
+
+        key = output_key(cp, params)
+        if request.if_none_match.contains(key):
+            response = Response(status=304)
+            response.set_etag(key)
+            return response
+
+        data = render_cache.memory.get(key)
+        path = render_cache.get_path(key) if data is None else None
+
+        if data is not None:
+            CACHE.inc(result="memory")
+            BYTES_OUT.inc(len(data), endpoint="generate")
+            response = send_file(io.BytesIO(data),
+                                 mimetype=mime,
+                                 download_name=download_name,
+                                 as_attachment=True,
+                                 etag=key)
+        elif path is not None:
+            CACHE.inc(result="disk")
+            BYTES_OUT.inc(os.path.getsize(path), endpoint="generate")
+            response = send_file(path,
+                                 mimetype=mime,
+                                 download_name=download_name,
+                                 as_attachment=True,
+                                 etag=key)
         else:
+            # Stream the document while it is encoded, page by page for tiled
+            # output, and keep a copy in the cache once it is complete
+            CACHE.inc(result="miss")
+            try:
+                chunks = stream_document(cp, params)
+            except Exception:
+                app.logger.exception("rendering failed for %s", params)
+                return Response(status=502)
+
+            response = Response(tee_to_cache(chunks, render_cache.writer(key)),
+                                mimetype=mime)
+            response.headers["Content-Disposition"] = f"attachment; filename={download_name}"
+            response.set_etag(key)
+
+        response.cache_control.no_cache = True
+        return response
+
+
+def describe_job(job):
+    status = {
+        "id": job["id"],
+        "status": job["status"],
+        "created": job["created"],
+        "started": job["started"],
+        "finished": job["finished"],
+        "error": job["error"]
+    }
+    if job["status"] == "queued":
+        status["position"] = job["position"]
+    if job["status"] == "done":
+        status["download"] = f"/jobs/{job['id']}/download"
+    return status
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return Response(status=404)
+    return jsonify(describe_job(job))
+
+
+@app.route("/jobs/<job_id>/download")
+def job_download(job_id):
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None or job["status"] != "done":
+        return Response(status=404)
+
+    BYTES_OUT.inc(os.path.getsize(queue.artifact(job_id)), endpoint="jobs")
+    return send_file(queue.artifact(job_id),
+                     mimetype=job["mime"],
+                     download_name=job["name"],
+                     as_attachment=True)
+
+
+@app.route("/measurements", methods=["POST"])
+def measurements():
+    try:
+        params = parse_form(request.form)
+    except ValueError as e:
+        return invalid_parameters(e)
+    if params is None:
+        return Response(status=502)
+
+    try:
+        cp = make_chute(params)
+        return jsonify(cp.metrics())
+    except ValueError as e:
+        return invalid_parameters(e)
+    except Exception:
+        app.logger.exception("measurements failed for %s", params)
+        return Response(status=502)
+
+
+def encode_preview(cp, resolution, fmt):
+    preview = cp.get_preview(resolution)
+    metrics = cp.summary()
+    metrics["document_size"] = {"width": preview["size"][0], "height": preview["size"][1]}
+
+    if fmt == "f32":
+        # two little endian uint32 point counts, then x, y of the cut line and
+        # of the stitch line as float32
+        body = (struct.pack("<II", len(preview["cut"]), len(preview["outline"]))
+                + preview["cut"].astype("<f4").tobytes()
+                + preview["outline"].astype("<f4").tobytes())
+        return (body, "application/octet-stream", json.dumps(metrics))
+
+    metrics["cut"] = np.round(preview["cut"].astype(float), 1).tolist()
+    metrics["outline"] = np.round(preview["outline"].astype(float), 1).tolist()
+    return (json.dumps(metrics).encode("utf-8"), "application/json", None)
+
+
+@app.route("/preview", methods=["POST"])
+def preview():
+    try:
+        params = parse_form(request.form)
+        resolution = min(max(int(request.form.get("resolution", 512)), 64), 2048)
+    except ValueError as e:
+        return invalid_parameters(e)
+    if params is None:
+        return Response(status=502)
+
+    fmt = request.form.get("format", "json")
+    if fmt not in ("json", "f32"):
+        return Response(status=400)
+
+    try:
+        cp = make_chute(params)
+        key = (cp.seam_key(), resolution, fmt)
+        encoded = preview_cache.get(key)
+        if encoded is None:
+            with stage("preview"):
+                encoded = encode_preview(cp, resolution, fmt)
+            preview_cache.put(key, encoded)
+    except ValueError as e:
+        return invalid_parameters(e)
+    except Exception:
+        app.logger.exception("preview failed for %s", params)
+        return Response(status=502)
+
+    body, mime, metrics = encoded
+    BYTES_OUT.inc(len(body), endpoint="preview")
+    response = Response(body, mimetype=mime)
+    if metrics is not None:
+        response.headers["X-Chute-Metrics"] = metrics
+    return response
+
+
+@app.route("/thumbnail")
+def thumbnail_png():
+    # GET, so that catalog pages can use it as image source
+    try:
+        params = parse_form(request.args)
+        if params is None:
             return Response(status=400)
+        width = min(max(int(request.args.get("width", 256)), 16), 1024)
+        height = min(max(int(request.args.get("height", width)), 16), 1024)
+        cp = make_chute(params)
+        cp.set_grid(False)
+    except ValueError as e:
+        return invalid_parameters(e)
+    except Exception:
+        app.logger.exception("invalid thumbnail parameters %s", params)
+        return Response(status=502)
+
+    key = cache_key({"thumbnail": repr(cp.seam_key()), "size": [width, height]})
+    if request.if_none_match.contains(key):
+        response = Response(status=304)
+    else:
+        data = thumbnail_cache.get(key)
+        CACHE.inc(result="memory" if data is not None else "miss")
+        if data is None:
+            try:
+                from RasterExport import thumbnail
+
+                with stage("thumbnail"):
+                    data = thumbnail(cp, width, height)
+            except Exception:
+                app.logger.exception("thumbnail failed for %s", params)
+                return Response(status=502)
+            thumbnail_cache.put(key, data)
+
+        BYTES_OUT.inc(len(data), endpoint="thumbnail")
+        response = Response(data, mimetype="image/png")
+
+    # the key covers everything the image depends on
+    response.set_etag(key)
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
 
-        return send_file(f,
-                         mimetype=mime,
-                         download_name=chute_type + ext,
-                         as_attachment=True)
 
 @app.route("/")
 def index():
@@ -183,5 +578,36 @@ def toroidal_chute():
     return render_template("toroidal.html", static = STATIC_CONTEXT)
 
 
+# Form values of the chutes rendered by warm_up
+WARM_UP = [
+    {"type": "hemispherical", "diameter": 1000.0, "spill_diameter": 100.0, "e": 0.7,
+     "panels": 8, "tangent_lines": True, "line_length": 2000.0, "seam_allowance": 10.0,
+     "joint_style": "miter", "grid": True, "file_type": "pdf", "tiling": True,
+     "paper_size": "A4", "margin": 10.0},
+    {"type": "toroidal", "diameter": 1000.0, "spill_diameter": 300.0, "e": 0.7,
+     "panels": 8, "tangent_lines": False, "line_length": 2000.0, "seam_allowance": 10.0,
+     "joint_style": "bevel", "grid": False, "file_type": "svg", "tiling": False,
+     "paper_size": None, "margin": None}
+]
+
+
+def warm_up():
+    # Renders a chute of each type once, so that lazily imported modules,
+    # cairo's font setup and the grid cell exist before uwsgi forks its
+    # workers and the first request of every worker doesn't pay for them
+    for params in WARM_UP:
+        try:
+            cp = make_chute(params)
+            cp.metrics()
+            render(cp, params)
+        except Exception:
+            app.logger.exception("warm up failed for %s", params)
+
+
+# Spawned job processes import this module as well, they don't need it
+if os.environ.get("CHUTEMAKER_PRELOAD", "1") != "0" and multiprocessing.parent_process() is None:
+    warm_up()
+
+
 if __name__ == "__main__":
     app.run("localhost", port=8080, debug=DEBUG)
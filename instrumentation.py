@@ -0,0 +1,144 @@
+""" ChuteMaker
+Copyright (C) 2022 Thomas Schmid
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Stage timers and process wide metrics. Every stage() is observed in a
+# latency histogram and, if timing was started for the current request or
+# command with start_timing(), also recorded for its Server-Timing header or
+# profile. Metrics are kept per process and rendered in the Prometheus text
+# format.
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_timings = contextvars.ContextVar("timings", default=None)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(labels.get(k, "") for k in self.labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> (bucket counts, sum, count)
+        self.values = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(k, "") for k in self.labels)
+        with self._lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                for bound, n in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(self.labels + ('le', ), key + (bound, ))} {n}")
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le', ), key + ('+Inf', ))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("chutemaker_stage_seconds",
+                          "Time spent in each stage of pattern generation",
+                          ("stage", ))
+REQUEST_SECONDS = Histogram("chutemaker_request_seconds",
+                            "Time until the response starts, per endpoint",
+                            ("endpoint", "status"))
+PAGES = Counter("chutemaker_pages_rendered_total", "Tiled pages rendered")
+BYTES_OUT = Counter("chutemaker_bytes_out_total", "Bytes of documents sent", ("endpoint", ))
+CACHE = Counter("chutemaker_render_cache_total", "Render cache lookups", ("result", ))
+ADMISSION = Counter("chutemaker_admission_total", "Requests rendered, queued or rejected by their estimated cost",
+                    ("decision", ))
+
+METRICS = [STAGE_SECONDS, REQUEST_SECONDS, PAGES, BYTES_OUT, CACHE, ADMISSION]
+
+
+def render_metrics():
+    lines = list()
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def start_timing():
+    _timings.set(list())
+
+
+def timings():
+    return _timings.get() or list()
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, stage=name)
+        recorded = _timings.get()
+        if recorded is not None:
+            recorded.append((name, duration))
+
+
+def server_timing(recorded):
+    return ", ".join(f"{name};dur={1000 * duration:.1f}" for name, duration in recorded)
+
+
+def profile(recorded):
+    # total time and count per stage, in order of first appearance
+    totals = dict()
+    for name, duration in recorded:
+        total, count = totals.get(name, (0, 0))
+        totals[name] = (total + duration, count + 1)
+    return totals
@@ -0,0 +1,175 @@
+""" ChuteMaker
+Copyright (C) 2022 Thomas Schmid
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Sends /generate requests from a number of concurrent clients to a running
+# server for a fixed time and reports throughput and latency. Meant to compare
+# the uwsgi and the ASGI server at the same number of cores, see the README.
+# Slow clients, which read the documents at a limited rate, show how long a
+# server is tied up by transfers. Only the standard library is used, so the
+# client does not compete with the server for an event loop implementation.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from urllib.parse import urlencode, urlsplit
+
+FORM = {
+    "type": "hemispherical",
+    "diameter": 1500,
+    "spillDiameter": 150,
+    "e": 0.7,
+    "panels": 12,
+    "jointStyle": "selectMitre",
+    "seamAllowance": 10,
+    "typeSelect": "pdf",
+    "grid": "on"
+}
+
+
+def form(args, rng):
+    values = dict(FORM, typeSelect=args.typ)
+    if args.tiled:
+        values.update(tiling="on", paperSize="A4", paperMargin=10)
+    # a different diameter for every request defeats the render cache
+    if not args.cached:
+        values["diameter"] = rng.randrange(500, 5000)
+    return urlencode(values).encode("ascii")
+
+
+async def request(host, port, body, read_rate):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(b"POST /generate HTTP/1.1\r\n"
+                     + f"Host: {host}\r\nContent-Type: application/x-www-form-urlencoded\r\n".encode("ascii")
+                     + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii")
+                     + body)
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        size = 0
+        while True:
+            # an emulated slow client reads 16 kB and waits
+            chunk = await reader.read(16 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+            if read_rate:
+                await asyncio.sleep(len(chunk) / read_rate)
+        return (status, size)
+    finally:
+        writer.close()
+
+
+async def client(args, host, port, deadline, results, rng, slow):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            status, size = await request(host, port, form(args, rng), args.slow_rate if slow else None)
+        except (OSError, ValueError, IndexError) as e:
+            status, size = type(e).__name__, 0
+        results.append({"status": status, "seconds": time.perf_counter() - start, "bytes": size, "slow": slow})
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else None
+
+
+def summary(results, duration):
+    ok = [r for r in results if r["status"] == 200]
+    fast = [r["seconds"] for r in ok if not r["slow"]]
+    errors = dict()
+    for r in results:
+        if r["status"] != 200:
+            errors[str(r["status"])] = errors.get(str(r["status"]), 0) + 1
+
+    return {
+        "requests": len(results),
+        "per second": len(ok) / duration,
+        "p50": percentile(fast, 50),
+        "p95": percentile(fast, 95),
+        "p99": percentile(fast, 99),
+        "megabytes": sum(r["bytes"] for r in ok) / 1024**2,
+        "errors": errors
+    }
+
+
+async def run(args):
+    url = urlsplit(args.url)
+    rng = random.Random(args.seed)
+    results = list()
+    deadline = time.perf_counter() + args.duration
+
+    await asyncio.gather(*(client(args, url.hostname, url.port or 80, deadline, results,
+                                  random.Random(rng.random()), i < args.slow)
+                           for i in range(args.concurrency)))
+    return summary(results, args.duration)
+
+
+def main(args):
+    result = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "label": args.label,
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "slow clients": args.slow,
+        "duration": args.duration,
+        "typ": args.typ,
+        "tiled": args.tiled,
+        "cached": args.cached
+    }
+    result.update(asyncio.run(run(args)))
+
+    latency = " ".join(f"{p} {1000 * result[p]:.0f} ms" for p in ("p50", "p95", "p99") if result[p] is not None)
+    print(f"{args.label or args.url}: {result['requests']} requests, {result['per second']:.1f}/s, {latency}, {result['megabytes']:.0f} MB, errors {result['errors'] or 'none'}")
+
+    history = list()
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            history = json.load(f)
+    history.append(result)
+    with open(args.history, "w") as f:
+        json.dump(history, f, indent=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load a running chutemaker web application with concurrent /generate requests")
+    parser.add_argument("url", nargs="?", default="http://127.0.0.1:8000", help="Server to load")
+    parser.add_argument("--concurrency", "-c", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--slow",
+                        type=int,
+                        default=0,
+                        help="How many of the clients read their responses at --slow_rate")
+    parser.add_argument("--slow_rate",
+                        type=float,
+                        default=64 * 1024,
+                        help="Read rate of slow clients in bytes per second")
+    parser.add_argument("--duration", "-d", type=float, default=30, help="Seconds to run")
+    parser.add_argument("--typ", choices=["pdf", "svg"], default="pdf", help="Requested file type")
+    parser.add_argument("--tiled", action="store_true", help="Request tiled A4 PDFs")
+    parser.add_argument("--cached",
+                        action="store_true",
+                        help="Request the same chute every time instead of a new diameter per request")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random diameters")
+    parser.add_argument("--label", help="Name of the server setup in the output and the history")
+    parser.add_argument("--history",
+                        default="loadtest_history.json",
+                        help="JSON file the results are appended to")
+    main(parser.parse_args())
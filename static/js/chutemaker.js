@@ -16,4 +16,76 @@ $("#svg").on("change", function() {
 
 $("#pdf").on("change", function() {
     $("#tiling").prop("disabled", false);
-});
\ No newline at end of file
+});
+// Live preview: the outline is fetched from /preview as float32 and drawn on
+// the canvas, at most once per pause in typing
+var previewTimer = null;
+var previewRequest = null;
+
+function drawPreview(canvas, data, metrics) {
+    var counts = new Uint32Array(data, 0, 2);
+    var cut = new Float32Array(data, 8, 2 * counts[0]);
+    var outline = new Float32Array(data, 8 + 8 * counts[0], 2 * counts[1]);
+
+    var ctx = canvas.getContext("2d");
+    var width = metrics.document_size.width;
+    var height = metrics.document_size.height;
+    var scale = Math.min(canvas.width / width, canvas.height / height);
+
+    ctx.setTransform(1, 0, 0, 1, 0, 0);
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    ctx.translate((canvas.width - scale * width) / 2, (canvas.height - scale * height) / 2);
+    ctx.scale(scale, scale);
+    ctx.lineWidth = 1 / scale;
+
+    [[cut, "#000"], [outline, "#0d6efd"]].forEach(function(line) {
+        var points = line[0];
+        ctx.beginPath();
+        for (var i = 0; i < points.length; i += 2) {
+            ctx.lineTo(points[i], points[i + 1]);
+        }
+        ctx.closePath();
+        ctx.strokeStyle = line[1];
+        ctx.stroke();
+    });
+
+    $("#previewMetrics").text(
+        "Gore " + metrics.bounding_box.width.toFixed(0) + " x " + metrics.bounding_box.height.toFixed(0) + " mm, " +
+        "fabric " + (metrics.total_cut_area / 1e6).toFixed(2) + " m², " +
+        "seams " + (metrics.total_seam_length / 1e3).toFixed(1) + " m");
+}
+
+function updatePreview() {
+    var form = $("form.needs-validation")[0];
+    var canvas = $("#preview")[0];
+    if (!form || !canvas || !form.checkValidity()) {
+        return;
+    }
+
+    var data = new FormData(form);
+    data.append("format", "f32");
+    data.append("resolution", canvas.width);
+
+    if (previewRequest) {
+        previewRequest.abort();
+    }
+    previewRequest = new AbortController();
+    fetch("/preview", {method: "POST", body: data, signal: previewRequest.signal})
+        .then(function(response) {
+            if (!response.ok) {
+                throw new Error(response.status);
+            }
+            var metrics = JSON.parse(response.headers.get("X-Chute-Metrics"));
+            return response.arrayBuffer().then(function(buffer) {
+                drawPreview(canvas, buffer, metrics);
+            });
+        })
+        .catch(function() {});
+}
+
+$("form.needs-validation").on("input change", function() {
+    clearTimeout(previewTimer);
+    previewTimer = setTimeout(updatePreview, 250);
+});
+
+$(updatePreview);
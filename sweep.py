@@ -0,0 +1,86 @@
+""" ChuteMaker
+Copyright (C) 2022 Thomas Schmid
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Derived quantities for whole grids of design points without building a
+# pattern per point. All parameters broadcast against each other like NumPy
+# arrays, all lengths are in mm and areas in mm^2. Gore width and area are
+# those of the finished gore, without seam allowance.
+
+import numpy as np
+import EllipticalChutePattern as elliptic
+import ToroidalChutePattern as toroidal
+
+
+def spherical_sweep(diameter, num_panels, e, line_length=None, spill_hole_diameter=0, tangent_lines=True):
+    diameter, num_panels, e, spill_hole_diameter, tangent_lines = np.broadcast_arrays(
+        np.asarray(diameter, dtype=float), num_panels, np.asarray(e, dtype=float),
+        np.asarray(spill_hole_diameter, dtype=float), np.asarray(tangent_lines, dtype=bool))
+    if line_length is None:
+        line_length = 2 * diameter
+    line_length = np.broadcast_to(np.asarray(line_length, dtype=float), diameter.shape)
+
+    a = diameter / 2
+    b = a * e
+
+    tangent_t = elliptic.tangential_line_point(a, e, line_length)
+    tmin = np.where(tangent_lines, -tangent_t, 0)
+    tmax = np.arccos(spill_hole_diameter / (2 * a))
+
+    area = elliptic.gore_area(a, b, num_panels, tmin, tmax)
+
+    return {
+        "tmin": tmin,
+        "tmax": tmax,
+        "tangent_t": tangent_t,
+        "gore_length": elliptic.arc_length(a, b, tmin, tmax),
+        "gore_width": 2 * np.pi * a * np.cos(np.clip(0, tmin, tmax)) / num_panels,
+        "gore_area": area,
+        "fabric_area": area * num_panels
+    }
+
+
+def toroidal_sweep(diameter, num_panels, e, line_length=None, spill_hole_diameter=0, tangent_lines=True):
+    diameter, num_panels, e, spill_hole_diameter, tangent_lines = np.broadcast_arrays(
+        np.asarray(diameter, dtype=float), num_panels, np.asarray(e, dtype=float),
+        np.asarray(spill_hole_diameter, dtype=float), np.asarray(tangent_lines, dtype=bool))
+    if line_length is None:
+        line_length = 2 * diameter
+    line_length = np.broadcast_to(np.asarray(line_length, dtype=float), diameter.shape)
+
+    r = diameter / 4 * e
+    rt = diameter / 2 - r
+    rs = toroidal.spill_radius(r, rt, spill_hole_diameter / 2)
+
+    tangent_t = toroidal.tangential_line_point(r, rt, line_length)
+    tmin = np.where(tangent_lines, -tangent_t, 0)
+    tmax = toroidal.torus_t(r, rt, rs)
+
+    area = 2 * np.pi * r / num_panels * (rt * (tmax - tmin) + r * (np.sin(tmax) - np.sin(tmin)))
+    lb, lc = toroidal.line_lengths(r, rt, rs, line_length)
+
+    return {
+        "tmin": tmin,
+        "tmax": tmax,
+        "tangent_t": tangent_t,
+        "spill_hole_diameter": 2 * rs,
+        "gore_length": (tmax - tmin) * r,
+        "gore_width": 2 * np.pi * (rt + r * np.cos(np.clip(0, tmin, tmax))) / num_panels,
+        "gore_area": area,
+        "fabric_area": area * num_panels,
+        "line_length_A": line_length,
+        "line_length_B": lb,
+        "line_length_C": lc
+    }
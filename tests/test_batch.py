@@ -0,0 +1,54 @@
+import json
+import os
+import subprocess
+import sys
+
+import chutemaker
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "chutemaker.py")
+
+DEFAULTS = {"panels": 8, "grid": False, "typ": "dxf"}
+
+
+def test_read_batch_jsonl_reports_bad_rows(tmp_path):
+    path = tmp_path / "specs.jsonl"
+    path.write_text('{"type": "spherical", "diameter": 500}\n'
+                    '{not json\n'
+                    '\n'
+                    '[1, 2]\n'
+                    '{"type": "toroidal", "diameter": 800, "form_factor": 0.6, "grid": "yes"}\n')
+
+    rows = chutemaker.read_batch(str(path), DEFAULTS)
+
+    assert [line for line, _, _ in rows] == [1, 2, 4, 5]
+    assert rows[0][1] == dict(DEFAULTS, type="spherical", diameter=500) and rows[0][2] is None
+    assert rows[1][1] is None and rows[1][2].startswith("JSONDecodeError")
+    assert rows[2][1] is None and "expected an object" in rows[2][2]
+    assert rows[3][1]["e"] == 0.6 and rows[3][1]["grid"] is True
+
+
+def test_read_batch_csv_reports_bad_rows(tmp_path):
+    path = tmp_path / "specs.csv"
+    path.write_text("type,diameter,panels\nspherical,500,\nspherical,600,12,extra\n")
+
+    rows = chutemaker.read_batch(str(path), DEFAULTS)
+
+    assert rows[0] == (2, dict(DEFAULTS, type="spherical", diameter="500"), None)
+    assert rows[1][0] == 3 and rows[1][1] is None and "more values than columns" in rows[1][2]
+
+
+def test_batch_continues_after_bad_rows(tmp_path):
+    specs = tmp_path / "specs.jsonl"
+    specs.write_text('{"type": "spherical", "diameter": 500, "name": "good"}\n'
+                     '{not json\n'
+                     '{"type": "spherical", "diameter": -5}\n')
+    output = tmp_path / "kit"
+    subprocess.run([sys.executable, SCRIPT, "--typ=dxf", "batch", str(specs), str(output)],
+                   check=True, capture_output=True)
+
+    manifest = json.loads((output / "manifest.json").read_text())
+    assert (manifest["rendered"], manifest["failed"]) == (1, 2)
+    items = {item["line"]: item for item in manifest["items"]}
+    assert items[1]["error"] is None and (output / "good.dxf").exists()
+    assert items[2]["error"].startswith("JSONDecodeError")
+    assert "diameter must be positive" in items[3]["error"]
@@ -0,0 +1,109 @@
+import itertools
+
+import numpy as np
+import pytest
+import shapely
+from scipy import integrate
+
+import chutemaker
+from ChutePattern import MitreType
+from ChuteSpec import ChuteSpec
+from EllipticalChutePattern import SphericalSpec, arc_length
+from GoreNester import GoreNester
+from PlotterExport import chute_layers, nested_layers
+from ToroidalChutePattern import ToroidalSpec
+
+
+def make_chute(**spec):
+    return chutemaker.make_chute(dict({"type": "spherical", "diameter": 1500, "panels": 12}, **spec))
+
+
+@pytest.mark.parametrize("a, b, t0, t1", [(750, 525, 0, np.pi / 2), (750, 525, -0.3, 1.2),
+                                          (500, 900, 0.1, 1.5), (600, 600, 0, 1)])
+def test_arc_length_matches_quadrature(a, b, t0, t1):
+    expected, _ = integrate.quad(lambda t: np.sqrt(a**2 * np.sin(t)**2 + b**2 * np.cos(t)**2), t0, t1)
+    assert arc_length(a, b, t0, t1) == pytest.approx(expected, rel=1e-9)
+
+
+@pytest.mark.parametrize("chute_type", ["spherical", "toroidal"])
+def test_round_offset_matches_buffer(chute_type):
+    chute = make_chute(type=chute_type, joint_style="round", seam_allowance="10")
+    _, outline = chute.get_outline()
+    polygon = chute.get_seam_polygon()
+    buffered = outline.buffer(10, quad_segs=64)
+
+    assert polygon.is_valid
+    assert polygon.area == pytest.approx(buffered.area, rel=1e-4)
+    assert polygon.symmetric_difference(buffered).area < 1e-4 * buffered.area
+
+
+def test_joint_styles_contain_stitch_line():
+    chute = make_chute(seam_allowance="10,20,0,15")
+    _, outline = chute.get_outline()
+    areas = dict()
+    for style in MitreType:
+        chute.set_joint_style(style)
+        polygon = chute.get_seam_polygon()
+        assert polygon.is_valid
+        assert polygon.buffer(1e-6).contains(outline)
+        areas[style] = polygon.area
+    # the corners only add fabric
+    assert min(areas.values()) == areas[MitreType.none]
+
+
+def test_uniform_joint_styles_are_ordered():
+    chute = make_chute(seam_allowance="10")
+    areas = list()
+    for style in (MitreType.none, MitreType.bevel, MitreType.round, MitreType.miter):
+        chute.set_joint_style(style)
+        areas.append(chute.get_seam_polygon().area)
+    assert areas == sorted(areas)
+
+
+@pytest.mark.parametrize("roll_width", [800, 1500])
+def test_nested_gores_do_not_overlap(roll_width):
+    chute = make_chute(panels=8)
+    nester = GoreNester(chute, roll_width, spacing=5)
+    nester.nest()
+    pieces = [nester.place(chute.get_seam_polygon(), p) for p in nester.placements]
+
+    assert len(pieces) == 8
+    for piece in pieces:
+        minx, miny, maxx, maxy = piece.bounds
+        assert miny >= -1e-6 and maxy <= roll_width + 1e-6
+        assert maxx <= nester.length + 1e-6
+    for p, q in itertools.combinations(pieces, 2):
+        assert shapely.distance(p, q) >= 5 - 2 * nester.tolerance
+    assert 0 < nester.utilization() <= 1
+
+
+def test_plotter_layers_mark_before_cut():
+    chute = make_chute()
+    assert [layer for layer, _ in chute_layers(chute)] == ["MARK", "CUT"]
+
+    layers = [layer for layer, _ in nested_layers(GoreNester(chute, 1500))]
+    assert layers == ["MARK"] * 12 + ["CUT"] * 12
+
+
+@pytest.mark.parametrize("spec_type, args, message", [
+    (SphericalSpec, (0, 12, 0.7), "diameter"),
+    (SphericalSpec, (1000, 0, 0.7), "panel"),
+    (SphericalSpec, (1000, 12, 0.7, False, None, 1000), "spill hole"),
+    (SphericalSpec, (1000, 12, 1.0, True, 2000), "tangent lines"),
+    (ToroidalSpec, (1000, 12, 2.0), "e must be smaller"),
+])
+def test_spec_validation(spec_type, args, message):
+    with pytest.raises(ValueError, match=message):
+        spec_type(*args)
+
+
+def test_equal_specs_are_interchangeable():
+    a = SphericalSpec(1000, 12, 0.7, True, 2000, 100)
+    b = SphericalSpec(1000.0, 12, 0.7, True, 2000.0, 100.0)
+    assert a == b and hash(a) == hash(b) and a.digest() == b.digest()
+
+
+def test_base_spec_defaults():
+    spec = ChuteSpec(1000, 12, 0.7, False)
+    assert (spec.tmin, spec.tangent_t, spec.tmax) == (0.0, 0.0, pytest.approx(np.pi / 2))
+    assert spec.line_lengths == dict()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+
+import pytest
+
+# no warm up renders on import, and a cache of the test's own
+os.environ["CHUTEMAKER_PRELOAD"] = "0"
+os.environ.setdefault("CHUTEMAKER_CACHE_DIR", tempfile.mkdtemp(prefix="chutemaker-test-cache-"))
+
+import chutemaker_webapp  # noqa: E402
+
+FORM = {
+    "type": "hemispherical",
+    "diameter": "1500",
+    "spillDiameter": "150",
+    "e": "0.7",
+    "panels": "12",
+    "jointStyle": "selectMitre",
+    "seamAllowance": "10",
+    "typeSelect": "pdf"
+}
+
+INVALID = [
+    ({"diameter": "abc"}, "could not convert string to float"),
+    ({"panels": "1.5"}, "invalid literal for int()"),
+    ({"diameter": "-5"}, "diameter must be positive"),
+    ({"spillDiameter": "2000"}, "spill hole diameter must be smaller"),
+    ({"e": "1", "tangentLines": "on", "lineLength": "3000"}, "tangent lines"),
+    ({"type": "conical"}, "unknown chute type"),
+]
+
+
+@pytest.fixture
+def client():
+    return chutemaker_webapp.app.test_client()
+
+
+@pytest.mark.parametrize("endpoint", ["/generate", "/preview", "/measurements"])
+@pytest.mark.parametrize("values, error", INVALID)
+def test_invalid_forms_are_bad_requests(client, endpoint, values, error):
+    response = client.post(endpoint, data=dict(FORM, **values))
+    assert response.status_code == 400
+    assert error in response.get_json()["error"]
+
+
+def test_invalid_preview_resolution(client):
+    response = client.post("/preview", data=dict(FORM, resolution="high"))
+    assert response.status_code == 400
+    assert "invalid literal for int()" in response.get_json()["error"]
+
+
+@pytest.mark.parametrize("values, error", INVALID + [({"width": "wide"}, "invalid literal for int()")])
+def test_invalid_thumbnail_queries_are_bad_requests(client, values, error):
+    response = client.get("/thumbnail", query_string=dict(FORM, **values))
+    assert response.status_code == 400
+    assert error in response.get_json()["error"]
+
+
+def test_margins_without_room_are_bad_requests(client):
+    response = client.post("/generate", data=dict(FORM, tiling="on", paperSize="A10", paperMargin="10"))
+    assert response.status_code == 400
+    assert "no room on the paper" in response.get_json()["error"]
+
+
+def test_valid_forms(client):
+    preview = client.post("/preview", data=FORM)
+    assert preview.status_code == 200
+    assert len(preview.get_json()["cut"]) > 0
+
+    measurements = client.post("/measurements", data=FORM)
+    assert measurements.status_code == 200
+    assert measurements.get_json()["area"] > 0
@@ -15,10 +15,96 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
 import math
+import threading
+from collections import OrderedDict
+
+PAPER_SIZES = {
+    "4A0": (1682, 2378),
+    "2A0": (1189, 1682),
+    "A0": (841, 1189),
+    "A1": (594, 841),
+    "A2": (420, 594),
+    "A3": (297, 420),
+    "A4": (210, 297),
+    "A5": (148, 210),
+    "A6": (105, 148),
+    "A7": (74, 105),
+    "A8": (52, 74),
+    "A9": (37, 52),
+    "A10": (26, 37),
+    "Letter": (216, 279),
+    "Legal": (216, 356),
+    "Tabloid": (279, 432),
+    "Ledger": (432, 279),
+    "Junior Legal": (127, 203),
+    "Half Letter": (140, 216),
+    "Government Letter": (203, 267),
+    "Government Legal": (216, 330),
+    "ANSI A": (216, 279),
+    "ANSI B": (279, 432),
+    "ANSI C": (432, 559),
+    "ANSI D": (559, 864),
+    "ANSI E": (864, 1118),
+    "ARCH A": (229, 305),
+    "ARCH B": (305, 457),
+    "ARCH C": (457, 610),
+    "ARCH D": (610, 914),
+    "ARCH E": (914, 1219),
+    "ARCH E1": (762, 1067),
+    "ARCH E2": (660, 965),
+    "ARCH E3": (686, 991)
+}
+
+# output formats, here so that the command line can offer them without
+# importing the exporters
+TILE_TYPES = ("png", "svg")
+RASTER_TYPES = ("png", "tiff")
+PLOTTER_TYPES = ("dxf", "hpgl")
+
+# major and minor tick of the pattern grid (mm)
+GRID_TICKS = (10, 1)
+
+def page_grid(size, paper_size, margins, overlap):
+    # columns and rows of pages needed for a document of size (mm)
+    if min(paper_size[0]-overlap-margins[0]-margins[2], paper_size[1]-overlap-margins[1]-margins[3]) <= 0:
+        raise ValueError("margins and overlap leave no room on the paper")
+    n = math.ceil(size[0] / (paper_size[0]-overlap-margins[0]-margins[2]))
+    m = math.ceil(size[1] / (paper_size[1]-overlap-margins[1]-margins[3]))
+    return (n, m)
 
 def mm_to_pt(mm):
     return mm * 72/25.4
 
+class LRUCache:
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
 def arrow(ctx, start, end, head_size=10, arrow_start = False, arrow_end = True):
     angle = math.atan2(end[1] - start[1], end[0] - start[0])
 